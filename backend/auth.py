@@ -1,45 +1,123 @@
+import hashlib
 import logging
 import os
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Optional
 
 from dotenv import load_dotenv
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from jose import JWTError, jwt
 
-# Configura il logging
-logging.basicConfig(level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s")
-
 load_dotenv()
 
+# Configura il logging
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
 SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
 ALGORITHM = "HS256"
 EXPECTED_AUDIENCE = "authenticated"
 
+# Seconds of tolerance on exp/nbf/iat, for clocks slightly out of sync with Supabase
+AUTH_CLOCK_SKEW = int(os.getenv("AUTH_CLOCK_SKEW", "30"))
+# Max number of verified tokens kept in memory
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "1024"))
+# How long (seconds) a token without exp is trusted before being verified again
+AUTH_TOKEN_CACHE_MAX_AGE = float(os.getenv("AUTH_TOKEN_CACHE_MAX_AGE", "300"))
+
 security = HTTPBearer()
 
-def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    token = credentials.credentials
-    logging.debug(f"🔹 Token ricevuto: {token}")
 
-    try:
-        # Verifica il token con l'audience corretta
-        payload = jwt.decode(token, SUPABASE_JWT_SECRET, algorithms=[ALGORITHM], audience=EXPECTED_AUDIENCE)
-        logging.debug(f"✅ Payload decodificato: {payload}")
+@dataclass(frozen=True)
+class UserContext:
+    user_id: str
+    email: Optional[str]
+    role: Optional[str]
+    expires_at: float
+
+
+# User of the request being served, set by verify_token
+current_user: ContextVar[Optional[UserContext]] = ContextVar("current_user", default=None)
+
+
+class TokenCache:
+    """
+    LRU cache of already verified tokens, keyed by the SHA-256 digest of the token.
+
+    An entry is dropped as soon as its token expires (exp plus the clock skew), so a cached
+    token is never accepted after jwt.decode would have rejected it.
+    """
+
+    def __init__(self, max_entries: int = AUTH_TOKEN_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[bytes, UserContext]" = OrderedDict()
 
-        user_id = payload.get("sub")
-        if user_id is None:
-            logging.warning("⚠️ Token valido ma manca 'sub'.")
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Token non valido: user_id mancante",
-            )
+    def get(self, key: bytes) -> Optional[UserContext]:
+        user = self._entries.get(key)
+        if user is None:
+            return None
+        if time.time() > user.expires_at:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return user
 
-        logging.info(f"✅ Utente autenticato: {user_id}")
-        return user_id
+    def set(self, key: bytes, user: UserContext):
+        self._entries[key] = user
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
 
+
+token_cache = TokenCache()
+
+
+def _decode(token: str) -> UserContext:
+    try:
+        # Verifica il token con l'audience corretta
+        payload = jwt.decode(
+            token,
+            SUPABASE_JWT_SECRET,
+            algorithms=[ALGORITHM],
+            audience=EXPECTED_AUDIENCE,
+            options={"leeway": AUTH_CLOCK_SKEW},
+        )
     except JWTError as e:
-        logging.error(f"❌ Errore JWT: {e}")
+        logger.warning(f"❌ Errore JWT: {e}")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Token non valido o scaduto",
-        )
\ No newline at end of file
+        )
+
+    user_id = payload.get("sub")
+    if user_id is None:
+        logger.warning("⚠️ Token valido ma manca 'sub'.")
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token non valido: user_id mancante",
+        )
+
+    exp = payload.get("exp")
+    expires_at = exp + AUTH_CLOCK_SKEW if exp is not None else time.time() + AUTH_TOKEN_CACHE_MAX_AGE
+    return UserContext(user_id=user_id, email=payload.get("email"), role=payload.get("role"), expires_at=expires_at)
+
+
+async def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)) -> str:
+    # Returns the user id; the signature is checked only the first time a token is seen
+    token = credentials.credentials
+    key = hashlib.sha256(token.encode()).digest()
+    user = token_cache.get(key)
+    if user is None:
+        user = _decode(token)
+        token_cache.set(key, user)
+    current_user.set(user)
+    return user.user_id
+
+
+async def get_current_user(user_id: str = Depends(verify_token)) -> UserContext:
+    # Dependency for endpoints that need more than the user id
+    return current_user.get()
@@ -0,0 +1,292 @@
+import os
+import re
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import asyncpg
+from bulk_import import insert_investments, validate_tickers
+from cashflow import sync as sync_cashflow
+from database import lock_user_data
+from fastapi import HTTPException
+from holdings import sync as sync_holdings
+from versions import bump as bump_versions
+
+# Max number of operations accepted in a single batch
+BATCH_MAX_OPERATIONS = int(os.getenv("BATCH_MAX_OPERATIONS", "500"))
+
+# Writable columns, required columns on create and date column of every entity
+ENTITIES = {
+    "transactions": {
+        "columns": ["type", "amount", "description", "category_id", "transaction_date"],
+        "required": ["type", "amount"],
+        "date": "transaction_date",
+    },
+    "investments": {
+        "columns": [
+            "type_of_operation", "asset_type", "ticker", "full_name",
+            "quantity", "total_value", "date_of_operation", "exchange",
+        ],
+        "required": [
+            "type_of_operation", "asset_type", "ticker", "full_name",
+            "quantity", "total_value", "date_of_operation",
+        ],
+        "date": "date_of_operation",
+    },
+    "categories": {
+        "columns": ["type", "name", "icon"],
+        "required": ["type", "name", "icon"],
+        "date": None,
+    },
+}
+
+# Fields that may hold a reference to the id created by an earlier op ("$<op index>"), with
+# the entity that op must have created (None: the entity of the referring op)
+REF_FIELDS = {"id": None, "category_id": "categories"}
+REF = re.compile(r"^\$(\d+)$")
+
+
+def _fail(index: int, detail: str, code: int = 400):
+    raise HTTPException(status_code=code, detail=f"Operation {index}: {detail}")
+
+
+def _validate(operations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # Checks every op before touching the DB, parses dates and records the referenced ops
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_OPERATIONS} operations per batch")
+    ops = []
+    for index, raw in enumerate(operations):
+        kind, entity = raw.get("op"), raw.get("entity")
+        if kind not in ("create", "update", "delete"):
+            _fail(index, "op must be create, update or delete")
+        if entity not in ENTITIES:
+            _fail(index, f"entity must be one of: {', '.join(ENTITIES)}")
+        spec = ENTITIES[entity]
+        data = dict(raw.get("data") or {})
+
+        unknown = [k for k in data if k not in spec["columns"]]
+        if unknown:
+            _fail(index, f"unknown fields {', '.join(unknown)}")
+        if kind == "create":
+            missing = [k for k in spec["required"] if data.get(k) is None]
+            if missing:
+                _fail(index, f"missing fields {', '.join(missing)}")
+            if entity == "transactions" and not data.get("transaction_date"):
+                data["transaction_date"] = date.today().isoformat()
+        elif raw.get("id") is None:
+            _fail(index, "id is required")
+        if kind == "update" and not data:
+            _fail(index, "nothing to update")
+        if spec["date"] and data.get(spec["date"]) is not None:
+            try:
+                data[spec["date"]] = datetime.strptime(str(data[spec["date"]]), "%Y-%m-%d").date()
+            except ValueError:
+                _fail(index, "Formato data non valido")
+        if entity == "investments" and "asset_type" in data and str(data["asset_type"]).lower() not in ["stock", "etf", "crypto"]:
+            _fail(index, f"Asset type {data['asset_type']} non supportato")
+
+        refs = set()
+        values = {"id": raw.get("id"), **data}
+        for field, ref_entity in REF_FIELDS.items():
+            match = REF.match(str(values.get(field))) if isinstance(values.get(field), str) else None
+            if match is None:
+                continue
+            ref = int(match.group(1))
+            ref_entity = ref_entity or entity
+            if ref >= index or operations[ref].get("op") != "create" or operations[ref].get("entity") != ref_entity:
+                _fail(index, f"{values[field]} must refer to an earlier create of {ref_entity}")
+            refs.add(ref)
+        ops.append({"index": index, "op": kind, "entity": entity, "id": raw.get("id"), "data": data, "refs": refs})
+    return ops
+
+
+def _groups(ops: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """
+    Splits the ordered ops into runs that can be sent as one pipelined statement: consecutive
+    ops of the same kind, entity and fields, none of them referring to an op of the same run.
+    """
+    groups: List[List[Dict[str, Any]]] = []
+    for op in ops:
+        current = groups[-1] if groups else None
+        if (
+            current
+            and (current[0]["op"], current[0]["entity"], sorted(current[0]["data"])) == (op["op"], op["entity"], sorted(op["data"]))
+            and not op["refs"] & {o["index"] for o in current}
+        ):
+            current.append(op)
+        else:
+            groups.append([op])
+    return groups
+
+
+def _resolve(value: Any, created: Dict[int, int]) -> Any:
+    if isinstance(value, str):
+        match = REF.match(value)
+        if match:
+            return created[int(match.group(1))]
+    return value
+
+
+async def _create(conn, user_id: str, entity: str, group: List[Dict[str, Any]], created: Dict[int, int]) -> List[Tuple[Any, ...]]:
+    if entity == "investments":
+        return await insert_investments(
+            conn, user_id,
+            [(op["index"], op["data"], op["data"]["date_of_operation"]) for op in group],
+        )
+
+    columns = sorted(group[0]["data"])
+    date_column = ENTITIES[entity]["date"]
+    placeholders = ", ".join(f"${i + 2}" for i in range(len(columns)))
+    returning = f"id, {date_column}" if date_column else "id"
+    rows = await conn.fetchmany(
+        f"INSERT INTO {entity} (user_id, {', '.join(columns)}) VALUES ($1, {placeholders}) RETURNING {returning}",
+        [(user_id, *(_resolve(op["data"][c], created) for c in columns)) for op in group],
+    )
+    return [(op["index"], r["id"]) for op, r in zip(group, rows)]
+
+
+async def _update(conn, user_id: str, entity: str, group: List[Dict[str, Any]], created: Dict[int, int], dates: List[date]):
+    columns = sorted(group[0]["data"])
+    date_column = ENTITIES[entity]["date"]
+    assignments = ", ".join(f"{c} = ${i + 3}" for i, c in enumerate(columns))
+    if entity == "investments":
+        # Old and new version are both returned: the snapshots are dirty from the earliest date,
+        # and the holdings of both tickers change
+        query = f"""
+            UPDATE {entity} t SET {assignments}
+            FROM (SELECT {date_column}, asset_type, ticker FROM {entity} WHERE id = $2 AND user_id = $1) old
+            WHERE t.id = $2 AND t.user_id = $1
+            RETURNING t.id, old.{date_column} AS old_date, t.{date_column} AS new_date,
+                      old.asset_type AS old_asset_type, old.ticker AS old_ticker, t.asset_type, t.ticker
+        """
+    elif date_column:
+        # Old and new date are both returned: the snapshots are dirty from the earliest of the two
+        query = f"""
+            UPDATE {entity} t SET {assignments}
+            FROM (SELECT {date_column} FROM {entity} WHERE id = $2 AND user_id = $1) old
+            WHERE t.id = $2 AND t.user_id = $1
+            RETURNING t.id, old.{date_column} AS old_date, t.{date_column} AS new_date
+        """
+    else:
+        query = f"UPDATE {entity} SET {assignments} WHERE id = $2 AND user_id = $1 RETURNING id"
+    ids = [_resolve(op["id"], created) for op in group]
+    rows = await conn.fetchmany(
+        query,
+        [(user_id, row_id, *(_resolve(op["data"][c], created) for c in columns)) for op, row_id in zip(group, ids)],
+    )
+    _check_found(group, ids, rows)
+    if date_column:
+        dates.extend(d for r in rows for d in (r["old_date"], r["new_date"]))
+
+    if entity == "investments":
+        await sync_holdings(conn, user_id, [
+            key for r in rows for key in ((r["old_asset_type"], r["old_ticker"]), (r["asset_type"], r["ticker"]))
+        ])
+        # Same as PUT /investments: a buy keeps its expense transaction in line
+        await conn.execute(
+            """
+            UPDATE transactions tr
+            SET amount = i.total_value,
+                description = 'buy ' || i.full_name,
+                transaction_date = i.date_of_operation
+            FROM investments i
+            WHERE i.id = ANY($2::int[]) AND i.user_id = $1
+              AND lower(i.type_of_operation) = 'buy'
+              AND tr.id = i.transaction_id AND tr.user_id = $1
+            """,
+            user_id, ids,
+        )
+
+
+async def _delete(conn, user_id: str, entity: str, group: List[Dict[str, Any]], created: Dict[int, int], dates: List[date]):
+    ids = [_resolve(op["id"], created) for op in group]
+    date_column = ENTITIES[entity]["date"]
+    if entity == "investments":
+        # The expense transaction of a buy goes with it
+        await conn.execute(
+            """
+            DELETE FROM transactions
+            WHERE user_id = $1
+              AND id IN (SELECT transaction_id FROM investments WHERE id = ANY($2::int[]) AND user_id = $1)
+            """,
+            user_id, ids,
+        )
+    returning = f"id, {date_column} AS old_date" if date_column else "id"
+    if entity == "investments":
+        returning += ", asset_type, ticker"
+    rows = await conn.fetch(
+        f"DELETE FROM {entity} WHERE id = ANY($2::int[]) AND user_id = $1 RETURNING {returning}",
+        user_id, ids,
+    )
+    _check_found(group, ids, rows)
+    if entity == "investments":
+        await sync_holdings(conn, user_id, [(r["asset_type"], r["ticker"]) for r in rows])
+    if date_column:
+        dates.extend(r["old_date"] for r in rows)
+
+
+def _check_found(group: List[Dict[str, Any]], ids: List[int], rows: List[asyncpg.Record]):
+    found = {r["id"] for r in rows}
+    for op, row_id in zip(group, ids):
+        if row_id not in found:
+            _fail(op["index"], f"{op['entity']} {row_id} not found or not authorized", 404)
+
+
+async def run_batch(
+    conn: asyncpg.Connection,
+    user_id: str,
+    operations: List[Dict[str, Any]],
+    validate_ticker,
+) -> Tuple[List[Dict[str, Any]], Optional[date]]:
+    """
+    Runs an ordered list of create/update/delete operations on transactions, investments and
+    categories, all in one DB transaction: either every op is applied or none.
+
+    Each op is {"op", "entity", "id" (update/delete), "data" (create/update)}; "id" and
+    "category_id" may be "$<n>" to use the id created by op n. Consecutive ops of the same shape
+    are pipelined in one executemany-style round trip. Tickers of new investments are validated
+    up front, once per distinct ticker.
+    Returns [{"op": index, "id": id}] and the earliest ledger date touched (None if none).
+    """
+    ops = _validate(operations)
+
+    new_tickers = [(op["data"]["asset_type"], op["data"]["ticker"]) for op in ops if op["entity"] == "investments" and op["op"] == "create"]
+    valid = await validate_tickers(new_tickers, validate_ticker)
+    for op in ops:
+        if op["entity"] == "investments" and op["op"] == "create":
+            status = valid[(op["data"]["asset_type"].lower(), op["data"]["ticker"].upper())]
+            if status is None:
+                _fail(op["index"], f"Impossibile verificare {op['data']['ticker']} in questo momento, riprovare tra poco", 503)
+            if not status:
+                _fail(op["index"], f"{op['data']['ticker']} non supportato, controllare se il nome è corretto o riprovare in futuro")
+
+    created: Dict[int, int] = {}
+    results: Dict[int, Any] = {}
+    dates: List[date] = []
+    async with conn.transaction():
+        await lock_user_data(conn, user_id)
+        for group in _groups(ops):
+            kind, entity = group[0]["op"], group[0]["entity"]
+            try:
+                if kind == "create":
+                    for index, row_id in await _create(conn, user_id, entity, group, created):
+                        created[index] = results[index] = row_id
+                    date_column = ENTITIES[entity]["date"]
+                    if date_column:
+                        dates.extend(op["data"][date_column] for op in group)
+                elif kind == "update":
+                    await _update(conn, user_id, entity, group, created, dates)
+                else:
+                    await _delete(conn, user_id, entity, group, created, dates)
+            except (asyncpg.DataError, asyncpg.IntegrityConstraintViolationError) as e:
+                first, last = group[0]["index"], group[-1]["index"]
+                where = f"Operation {first}" if first == last else f"Operations {first}-{last}"
+                raise HTTPException(status_code=400, detail=f"{where}: {e}")
+            for op in group:
+                results.setdefault(op["index"], _resolve(op["id"], created))
+        # Daily cashflow of every date touched (investment dates are those of their buy transactions)
+        await sync_cashflow(conn, user_id, dates)
+        # Investments also write their buy transactions
+        touched = {op["entity"] for op in ops}
+        await bump_versions(conn, user_id, touched | ({"transactions"} if "investments" in touched else set()))
+
+    return [{"op": index, "id": results[index]} for index in sorted(results)], min(dates, default=None)
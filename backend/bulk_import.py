@@ -0,0 +1,445 @@
+import asyncio
+import codecs
+import csv
+import html
+import json
+import re
+import unicodedata
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import asyncpg
+from fastapi import HTTPException
+from cashflow import sync as sync_cashflow
+from database import lock_user_data
+from holdings import sync as sync_holdings
+from versions import bump as bump_versions
+
+FORMATS = ("csv", "ofx", "ndjson")
+
+# Index used to skip rows that are already in the ledger (same day, amount and description)
+SCHEMA = """
+CREATE INDEX IF NOT EXISTS transactions_dedup_idx
+    ON transactions (user_id, transaction_date, amount, (COALESCE(description, '')));
+"""
+
+CSV_DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d.%m.%Y", "%d-%m-%Y")
+# Accepted CSV header names, per field
+CSV_COLUMNS = {
+    "date": ("date", "transaction_date", "data"),
+    "amount": ("amount", "importo"),
+    "description": ("description", "descrizione", "memo"),
+    "type": ("type", "tipo"),
+    "category": ("category", "categoria"),
+}
+
+
+class RowError(ValueError):
+    pass
+
+
+async def ensure_schema(conn: asyncpg.Connection):
+    await conn.execute(SCHEMA)
+
+
+async def _lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    # Decodes the upload as it arrives and yields it line by line
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+def _parse_amount(value: Any) -> Decimal:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return Decimal(str(value))
+    # Spaces and currency symbols ("€ 1.234,56") are dropped, anything else is an error
+    text = "".join(ch for ch in str(value or "") if not ch.isspace() and unicodedata.category(ch) != "Sc")
+    if not re.fullmatch(r"[+-]?[\d,.]*\d[\d,.]*", text):
+        raise RowError(f"invalid amount {value!r}")
+    # "1.234,56" and "1,234.56": the last separator is the decimal one. With one kind of
+    # separator, a repeated one groups thousands ("1.234.567"), and a single one followed by
+    # exactly three digits ("1,234" or "1.234") could be either
+    separators = set(re.findall(r"[,.]", text))
+    if len(separators) == 2:
+        decimal = "," if text.rfind(",") > text.rfind(".") else "."
+    elif separators:
+        decimal = separators.pop()
+        integer, _, fraction = text.rpartition(decimal)
+        if text.count(decimal) > 1:
+            decimal = None
+        elif len(fraction) == 3 and integer.lstrip("+-") not in ("", "0"):
+            raise RowError(f"ambiguous amount {value!r}: thousands or decimal separator?")
+    else:
+        decimal = None
+    text = re.sub(r"[,.]", lambda m: "." if m.group() == decimal else "", text)
+    try:
+        amount = Decimal(text)
+    except InvalidOperation:
+        raise RowError(f"invalid amount {value!r}")
+    if not amount.is_finite():
+        raise RowError(f"invalid amount {value!r}")
+    return amount
+
+
+def _parse_date(value: Any, formats=CSV_DATE_FORMATS) -> date:
+    text = str(value or "").strip()
+    for fmt in formats:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    raise RowError(f"invalid date {value!r}")
+
+
+async def _csv_rows(lines: AsyncIterator[str]) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+    # Header first; quoted fields can contain the delimiter but not line breaks
+    columns = None
+    delimiter = ","
+    row_no = 0
+    async for line in lines:
+        row_no += 1
+        if not line.strip():
+            continue
+        if columns is None:
+            # Many European banks export with ";"
+            if line.count(";") > line.count(","):
+                delimiter = ";"
+            header = [h.strip().lower() for h in next(csv.reader([line], delimiter=delimiter))]
+            columns = {}
+            for field, names in CSV_COLUMNS.items():
+                for i, h in enumerate(header):
+                    if h in names:
+                        columns[field] = i
+                        break
+            if "date" not in columns or "amount" not in columns:
+                raise HTTPException(status_code=400, detail="CSV header must have at least a date and an amount column")
+            continue
+        values = next(csv.reader([line], delimiter=delimiter))
+        yield row_no, {field: values[i].strip() if i < len(values) else None for field, i in columns.items()}
+
+
+async def _ndjson_rows(lines: AsyncIterator[str]) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+    # Same keys as POST /transactions, plus "category" (name) and "date" as an alias
+    row_no = 0
+    async for line in lines:
+        row_no += 1
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError:
+            yield row_no, RowError("invalid JSON")
+            continue
+        if not isinstance(item, dict):
+            yield row_no, RowError("expected a JSON object")
+            continue
+        if "transaction_date" in item:
+            item["date"] = item.pop("transaction_date")
+        yield row_no, item
+
+
+async def _ofx_rows(lines: AsyncIterator[str]) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+    # Works on SGML (unclosed tags) and XML OFX alike: the text is cut at every "<"
+    row_no = 0
+    current: Optional[Dict[str, str]] = None
+    pending = ""
+    async for line in lines:
+        pending += line + "\n"
+        *tokens, pending = pending.split("<")
+        for token in tokens:
+            tag, _, value = token.partition(">")
+            # Text is SGML/XML escaped ("AT&amp;T")
+            tag, value = tag.strip().upper(), html.unescape(value.strip())
+            if tag == "STMTTRN":
+                current = {}
+            elif tag == "/STMTTRN" and current is not None:
+                row_no += 1
+                yield row_no, {
+                    "date": current.get("DTPOSTED"),
+                    "amount": current.get("TRNAMT"),
+                    "description": current.get("NAME") or current.get("MEMO"),
+                }
+                current = None
+            elif current is not None and tag and not tag.startswith("/"):
+                current[tag] = value
+
+
+def _normalize(item: Dict[str, Any], fmt: str, categories: Dict[Tuple[str, str], int], category_ids: set) -> tuple:
+    # -> (transaction_date, type, amount, description, category_id), amounts are stored positive
+    if fmt == "ofx":
+        transaction_date = _parse_date((item.get("date") or "")[:8], ("%Y%m%d",))
+    else:
+        transaction_date = _parse_date(item.get("date"))
+    amount = _parse_amount(item.get("amount"))
+
+    kind = str(item.get("type") or "").strip().lower()
+    if not kind:
+        kind = "expense" if amount < 0 else "income"
+    elif kind not in ("income", "expense"):
+        raise RowError(f"invalid type {item.get('type')!r}")
+    if amount == 0:
+        raise RowError("amount is zero")
+
+    description = str(item.get("description") or "").strip() or None
+
+    category_id = None
+    if item.get("category_id") is not None:
+        category_id = item["category_id"]
+        if category_id not in category_ids:
+            raise RowError(f"unknown category_id {category_id!r}")
+    elif item.get("category"):
+        category_id = categories.get((kind, str(item["category"]).strip().lower()))
+        if category_id is None:
+            raise RowError(f"unknown {kind} category {item['category']!r}")
+
+    return transaction_date, kind, abs(amount), description, category_id
+
+
+async def import_transactions(
+    conn: asyncpg.Connection,
+    user_id: str,
+    chunks: AsyncIterator[bytes],
+    fmt: str,
+) -> Dict[str, Any]:
+    """
+    Imports a bank statement (CSV, OFX or NDJSON) streamed as raw bytes.
+
+    Rows are parsed as they arrive and COPYed into a temporary table, then inserted in one
+    statement, skipping those already in the ledger. Everything runs in a single DB transaction.
+    Returns the number of imported rows, the first imported date, the rows skipped as
+    duplicates and the per-row errors (row = line number, or transaction number for OFX).
+    """
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(FORMATS)}")
+    parser = {"csv": _csv_rows, "ofx": _ofx_rows, "ndjson": _ndjson_rows}[fmt]
+
+    categories = {}
+    category_ids = set()
+    for r in await conn.fetch("SELECT id, type, name FROM categories WHERE user_id = $1", user_id):
+        categories.setdefault((r["type"], (r["name"] or "").strip().lower()), r["id"])
+        category_ids.add(r["id"])
+
+    errors: List[Dict[str, Any]] = []
+
+    async def records():
+        async for row_no, item in parser(_lines(chunks)):
+            try:
+                if isinstance(item, RowError):
+                    raise item
+                yield (row_no, *_normalize(item, fmt, categories, category_ids))
+            except RowError as e:
+                errors.append({"row": row_no, "error": str(e)})
+
+    async with conn.transaction():
+        await lock_user_data(conn, user_id)
+        await conn.execute(
+            """
+            CREATE TEMP TABLE import_rows (
+                row_no INT, transaction_date DATE, type TEXT, amount NUMERIC, description TEXT, category_id INT
+            ) ON COMMIT DROP
+            """
+        )
+        await conn.copy_records_to_table(
+            "import_rows",
+            columns=["row_no", "transaction_date", "type", "amount", "description", "category_id"],
+            records=records(),
+        )
+        duplicates = await conn.fetch(
+            """
+            SELECT i.row_no
+            FROM import_rows i
+            WHERE EXISTS (
+                SELECT 1 FROM transactions t
+                WHERE t.user_id = $1
+                  AND t.transaction_date = i.transaction_date
+                  AND t.amount = i.amount
+                  AND COALESCE(t.description, '') = COALESCE(i.description, '')
+            )
+            ORDER BY i.row_no
+            """,
+            user_id,
+        )
+        inserted = await conn.fetchrow(
+            """
+            WITH new_rows AS (
+                INSERT INTO transactions (user_id, type, amount, description, category_id, transaction_date)
+                SELECT $1, i.type, i.amount, i.description, i.category_id, i.transaction_date
+                FROM import_rows i
+                WHERE i.row_no <> ALL($2::int[])
+                ORDER BY i.row_no
+                RETURNING transaction_date
+            )
+            SELECT COUNT(*) AS imported, MIN(transaction_date) AS first_date,
+                   array_agg(DISTINCT transaction_date) AS days
+            FROM new_rows
+            """,
+            user_id, [r["row_no"] for r in duplicates],
+        )
+        await sync_cashflow(conn, user_id, inserted["days"] or [])
+        if inserted["imported"]:
+            await bump_versions(conn, user_id, ["transactions"])
+
+    return {
+        "imported": inserted["imported"],
+        "first_date": inserted["first_date"],
+        "duplicates": [r["row_no"] for r in duplicates],
+        "errors": errors,
+    }
+
+
+async def validate_tickers(pairs: List[Tuple[str, str]], validate_ticker) -> Dict[Tuple[str, str], Optional[bool]]:
+    # One concurrent provider lookup per distinct (asset type, ticker), keyed by (lower, UPPER)
+    distinct = {}
+    for asset_type, ticker in pairs:
+        distinct.setdefault((asset_type.lower(), ticker.upper()), ticker)
+    checks = await asyncio.gather(*(validate_ticker(asset_type, ticker) for (asset_type, _), ticker in distinct.items()))
+    return dict(zip(distinct, checks))
+
+
+async def insert_investments(
+    conn: asyncpg.Connection,
+    user_id: str,
+    rows: List[Tuple[int, Dict[str, Any], date]],
+) -> List[Tuple[int, int]]:
+    """
+    Writes already validated investments, given as (row_no, item, date_of_operation), with the
+    expense transactions of the buys in a single statement. Ids are drawn from the sequences up
+    front so each investment is created already linked to its transaction.
+    Returns (row_no, investment id) pairs; meant to run inside a DB transaction.
+    """
+    cat_id = None
+    if any(item["type_of_operation"].lower() == "buy" for _, item, _ in rows):
+        # The "investments" category, resolved once for the whole batch
+        cat_id = await conn.fetchval(
+            "SELECT id FROM categories WHERE user_id = $1 AND name = 'investments' LIMIT 1", user_id
+        )
+        if not cat_id:
+            cat_id = await conn.fetchval(
+                """
+                INSERT INTO categories (user_id, type, name, icon)
+                VALUES ($1, 'expense', 'investments', 'IconChart')
+                RETURNING id;
+                """,
+                user_id,
+            )
+            await bump_versions(conn, user_id, ["categories"])
+
+    created = await conn.fetch(
+        """
+        WITH input AS (
+            SELECT *
+            FROM unnest($3::int[], $4::text[], $5::text[], $6::text[], $7::text[],
+                        $8::float8[], $9::float8[], $10::date[], $11::text[])
+                AS x(row_no, type_of_operation, asset_type, ticker, full_name,
+                     quantity, total_value, date_of_operation, exchange)
+        ),
+        numbered AS (
+            SELECT
+                input.*,
+                nextval(pg_get_serial_sequence('investments', 'id')) AS investment_id,
+                CASE WHEN lower(type_of_operation) = 'buy'
+                     THEN nextval(pg_get_serial_sequence('transactions', 'id')) END AS transaction_id
+            FROM input
+        ),
+        new_transactions AS (
+            INSERT INTO transactions (id, user_id, type, amount, description, category_id, transaction_date)
+            SELECT transaction_id, $1, 'expense', total_value, 'buy ' || full_name, $2, date_of_operation
+            FROM numbered
+            WHERE transaction_id IS NOT NULL
+        ),
+        new_investments AS (
+            INSERT INTO investments (
+                id, user_id, type_of_operation, asset_type, ticker, full_name,
+                quantity, total_value, date_of_operation, exchange, transaction_id
+            )
+            SELECT investment_id, $1, type_of_operation, asset_type, ticker, full_name,
+                   quantity, total_value, date_of_operation, exchange, transaction_id
+            FROM numbered
+        )
+        SELECT row_no, investment_id FROM numbered ORDER BY row_no
+        """,
+        user_id,
+        cat_id,
+        [row_no for row_no, _, _ in rows],
+        [item["type_of_operation"] for _, item, _ in rows],
+        [item["asset_type"] for _, item, _ in rows],
+        [item["ticker"] for _, item, _ in rows],
+        [item["full_name"] for _, item, _ in rows],
+        [item["quantity"] for _, item, _ in rows],
+        [item["total_value"] for _, item, _ in rows],
+        [op_date for _, _, op_date in rows],
+        [item.get("exchange") for _, item, _ in rows],
+    )
+    await sync_holdings(conn, user_id, [(item["asset_type"], item["ticker"]) for _, item, _ in rows])
+    await sync_cashflow(conn, user_id, [op_date for _, item, op_date in rows if item["type_of_operation"].lower() == "buy"])
+    await bump_versions(conn, user_id, ["investments", "transactions"] if cat_id else ["investments"])
+    return [(r["row_no"], r["investment_id"]) for r in created]
+
+
+async def import_investments(
+    conn: asyncpg.Connection,
+    user_id: str,
+    investments: List[Dict[str, Any]],
+    validate_ticker,
+) -> Dict[str, Any]:
+    """
+    Inserts many investments (dicts with the fields of POST /investments) at once.
+
+    Every distinct (asset type, ticker) is validated once, all concurrently, through the async
+    `validate_ticker(asset_type, ticker)`, then the valid rows are written with insert_investments.
+    Invalid rows are reported per row (row = index in the list).
+    """
+    errors: List[Dict[str, Any]] = []
+    rows = []
+    for row_no, item in enumerate(investments):
+        try:
+            asset_type = item["asset_type"].lower()
+            if asset_type not in ["stock", "etf", "crypto"]:
+                raise RowError(f"Asset type {item['asset_type']} non supportato")
+            try:
+                op_date = datetime.strptime(item["date_of_operation"], "%Y-%m-%d").date()
+            except ValueError:
+                raise RowError("Formato data non valido")
+            rows.append((row_no, asset_type, item, op_date))
+        except RowError as e:
+            errors.append({"row": row_no, "error": str(e)})
+
+    valid = await validate_tickers([(asset_type, item["ticker"]) for _, asset_type, item, _ in rows], validate_ticker)
+
+    accepted = []
+    for row_no, asset_type, item, op_date in rows:
+        status = valid[(asset_type, item["ticker"].upper())]
+        if status:
+            accepted.append((row_no, item, op_date))
+        elif status is None:
+            errors.append({
+                "row": row_no,
+                "error": f"Impossibile verificare {item['ticker']} in questo momento, riprovare tra poco",
+            })
+        else:
+            errors.append({
+                "row": row_no,
+                "error": f"{item['ticker']} non supportato, controllare se il nome è corretto o riprovare in futuro",
+            })
+    errors.sort(key=lambda e: e["row"])
+
+    if not accepted:
+        return {"created": [], "first_date": None, "errors": errors}
+
+    async with conn.transaction():
+        await lock_user_data(conn, user_id)
+        created = await insert_investments(conn, user_id, accepted)
+
+    return {
+        "created": [{"row": row_no, "id": investment_id} for row_no, investment_id in created],
+        "first_date": min(op_date for _, _, op_date in accepted),
+        "errors": errors,
+    }
@@ -0,0 +1,138 @@
+import logging
+from datetime import date
+from typing import Iterable, Optional
+
+import asyncpg
+from database import lock_user_data, run_rebuild_cli
+
+logger = logging.getLogger(__name__)
+
+# balance is the cumulative income - expense of the user up to and including the day
+# (the initial balance of the account is not included)
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cashflow_daily (
+    user_id UUID NOT NULL,
+    day DATE NOT NULL,
+    income NUMERIC NOT NULL,
+    expense NUMERIC NOT NULL,
+    balance NUMERIC NOT NULL,
+    PRIMARY KEY (user_id, day)
+);
+"""
+
+# Income and expense per (user, day) of the transactions matching {where}
+DAILY_QUERY = """
+    SELECT user_id, transaction_date AS day,
+           COALESCE(SUM(amount) FILTER (WHERE type = 'income'), 0) AS income,
+           COALESCE(SUM(amount) FILTER (WHERE type = 'expense'), 0) AS expense
+    FROM transactions
+    WHERE transaction_date IS NOT NULL AND {where}
+    GROUP BY user_id, transaction_date
+"""
+
+
+async def ensure_schema(conn: asyncpg.Connection):
+    created = await conn.fetchval("SELECT to_regclass('cashflow_daily') IS NULL")
+    await conn.execute(SCHEMA)
+    if created:
+        # First start with the table: backfill it from the existing transactions
+        await rebuild(conn)
+        logger.info("✅ Daily cashflow table created and backfilled")
+
+
+async def sync(conn: asyncpg.Connection, user_id: str, days: Iterable[Optional[date]]):
+    """
+    Recomputes the rollup rows of the given days from their transactions, then shifts the
+    running balance of every later day. Called by every write on transactions, inside the
+    same DB transaction, with both the old and the new date of the touched rows.
+    """
+    days = sorted({d for d in days if d is not None})
+    if not days:
+        return
+    # Concurrent writes of the same user would both re-insert the same days, and each would
+    # shift the later running balances from its own snapshot
+    await lock_user_data(conn, user_id)
+    await conn.execute("DELETE FROM cashflow_daily WHERE user_id = $1 AND day = ANY($2::date[])", user_id, days)
+    await conn.execute(
+        f"""
+        INSERT INTO cashflow_daily (user_id, day, income, expense, balance)
+        SELECT user_id, day, income, expense, 0
+        FROM ({DAILY_QUERY.format(where="user_id = $1 AND transaction_date = ANY($2::date[])")}) daily
+        """,
+        user_id, days,
+    )
+    await conn.execute(
+        """
+        UPDATE cashflow_daily c
+        SET balance = r.balance
+        FROM (
+            SELECT day,
+                   COALESCE((
+                       SELECT balance FROM cashflow_daily
+                       WHERE user_id = $1 AND day < $2
+                       ORDER BY day DESC
+                       LIMIT 1
+                   ), 0) + SUM(income - expense) OVER (ORDER BY day) AS balance
+            FROM cashflow_daily
+            WHERE user_id = $1 AND day >= $2
+        ) r
+        WHERE c.user_id = $1 AND c.day = r.day AND c.balance IS DISTINCT FROM r.balance
+        """,
+        user_id, days[0],
+    )
+
+
+async def clear(conn: asyncpg.Connection, user_id: str):
+    # For the endpoints that delete every transaction of the user
+    await conn.execute("DELETE FROM cashflow_daily WHERE user_id = $1", user_id)
+
+
+async def rebuild(conn: asyncpg.Connection, user_id: Optional[str] = None) -> int:
+    """
+    Backfill / consistency rebuild: recomputes the rollup of one user (or of everyone) from the
+    transactions table. Returns how many rows were out of sync before the rebuild.
+    """
+    where, args = ("user_id = $1", [user_id]) if user_id else ("TRUE", [])
+    async with conn.transaction():
+        await conn.execute(
+            f"""
+            CREATE TEMP TABLE cashflow_rebuild ON COMMIT DROP AS
+            SELECT user_id, day, income, expense,
+                   SUM(income - expense) OVER (PARTITION BY user_id ORDER BY day) AS balance
+            FROM ({DAILY_QUERY.format(where=where)}) daily
+            """,
+            *args,
+        )
+        drift = await conn.fetchval(
+            f"""
+            SELECT COUNT(*)
+            FROM (SELECT * FROM cashflow_daily WHERE {where}) c
+            FULL JOIN cashflow_rebuild r USING (user_id, day)
+            WHERE c.income IS DISTINCT FROM r.income
+               OR c.expense IS DISTINCT FROM r.expense
+               OR c.balance IS DISTINCT FROM r.balance
+            """,
+            *args,
+        )
+        await conn.execute(f"DELETE FROM cashflow_daily WHERE {where}", *args)
+        await conn.execute("INSERT INTO cashflow_daily SELECT * FROM cashflow_rebuild")
+    return drift
+
+
+async def balance_as_of(conn, user_id: str, day: Optional[date] = None) -> float:
+    # Net cashflow up to and including `day` (None: every transaction, future-dated ones too)
+    value = await conn.fetchval(
+        """
+        SELECT balance FROM cashflow_daily
+        WHERE user_id = $1 AND ($2::date IS NULL OR day <= $2)
+        ORDER BY day DESC
+        LIMIT 1
+        """,
+        user_id, day,
+    )
+    return float(value or 0)
+
+
+if __name__ == "__main__":
+    # Backfill / consistency rebuild: python cashflow.py [user_id]
+    run_rebuild_cli(SCHEMA, rebuild, "daily cashflow rows")
@@ -0,0 +1,145 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from pycoingecko import CoinGeckoAPI
+
+logger = logging.getLogger(__name__)
+
+COIN_INDEX_PATH = os.getenv(
+    "COIN_INDEX_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "coingecko_coins.json"),
+)
+# Seconds after which the index is downloaded again
+COIN_INDEX_MAX_AGE = float(os.getenv("COIN_INDEX_MAX_AGE", "86400"))
+# Number of market-cap pages (250 coins each) used to rank coins sharing a symbol
+COIN_INDEX_RANKED_PAGES = int(os.getenv("COIN_INDEX_RANKED_PAGES", "4"))
+
+
+class CoinIndex:
+    """
+    In-memory symbol/name/id → CoinGecko coin id index, persisted to disk.
+
+    When several coins share a symbol or a name, the one with the best market-cap
+    rank wins; unranked coins are ordered by id length and then alphabetically,
+    so the same query always resolves to the same coin.
+    """
+
+    def __init__(self, path: str = COIN_INDEX_PATH, max_age: float = COIN_INDEX_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self.built_at = 0.0
+        self._by_symbol: Dict[str, str] = {}
+        self._by_name: Dict[str, str] = {}
+        self._ids = set()
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._last_load_attempt = 0.0
+
+    @property
+    def loaded(self) -> bool:
+        return bool(self._ids)
+
+    @property
+    def stale(self) -> bool:
+        return time.time() - self.built_at > self.max_age
+
+    def _build(self, coins: List[dict], built_at: float):
+        def sort_key(c):
+            rank = c.get("rank")
+            return (rank if rank is not None else float("inf"), len(c["id"]), c["id"])
+
+        by_symbol, by_name = {}, {}
+        # Iterate worst-first so the preferred coin overwrites the others
+        for coin in sorted(coins, key=sort_key, reverse=True):
+            by_symbol[coin["symbol"].upper()] = coin["id"]
+            by_name[coin["name"].upper()] = coin["id"]
+
+        with self._lock:
+            self._by_symbol = by_symbol
+            self._by_name = by_name
+            self._ids = {c["id"] for c in coins}
+            self.built_at = built_at
+
+    def _download(self) -> List[dict]:
+        cg = CoinGeckoAPI()
+        ranks = {}
+        for page in range(1, COIN_INDEX_RANKED_PAGES + 1):
+            for market in cg.get_coins_markets(vs_currency="eur", per_page=250, page=page):
+                if market.get("market_cap_rank") is not None:
+                    ranks[market["id"]] = market["market_cap_rank"]
+        return [
+            {"id": c["id"], "symbol": c["symbol"], "name": c["name"], "rank": ranks.get(c["id"])}
+            for c in cg.get_coins_list()
+            if c.get("id") and c.get("symbol")
+        ]
+
+    def refresh(self) -> bool:
+        # Downloads the full coin list, keeps the previous index if the provider fails
+        try:
+            coins = self._download()
+        except Exception as e:
+            logger.warning(f"⚠️ CoinGecko coin list download failed: {e}")
+            return False
+
+        built_at = time.time()
+        self._build(coins, built_at)
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"built_at": built_at, "coins": coins}, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"⚠️ Unable to persist coin index to {self.path}: {e}")
+        logger.info(f"✅ Coin index refreshed ({len(coins)} coins)")
+        return True
+
+    def load(self):
+        # Loads the index from disk, downloading it if missing or too old
+        self._last_load_attempt = time.time()
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            self._build(data["coins"], data["built_at"])
+        except (OSError, ValueError, KeyError) as e:
+            logger.info(f"Coin index not available on disk ({e}), downloading it")
+        if not self.loaded or self.stale:
+            self.refresh()
+
+    def resolve(self, query: str) -> Optional[str]:
+        """
+        Returns the coin id for a symbol ("BTC"), a name ("Bitcoin") or an id ("bitcoin").
+        """
+        if not query:
+            return None
+        if not self.loaded:
+            with self._load_lock:
+                # Retry at most once a minute while CoinGecko is unreachable
+                if not self.loaded and time.time() - self._last_load_attempt > 60:
+                    self.load()
+
+        key = query.strip().upper()
+        coin_id = self._by_symbol.get(key) or self._by_name.get(key)
+        if coin_id is None and query.strip().lower() in self._ids:
+            coin_id = query.strip().lower()
+        return coin_id
+
+
+# Shared instance used by every endpoint of the process
+coin_index = CoinIndex()
+
+
+def resolve_coin_id(ticker: str) -> Optional[str]:
+    return coin_index.resolve(ticker)
+
+
+async def run_refresher(interval: float = COIN_INDEX_MAX_AGE):
+    # Background task: keeps the index up to date without blocking requests
+    while True:
+        await asyncio.sleep(interval)
+        await asyncio.to_thread(coin_index.refresh)
@@ -1,8 +1,14 @@
+import asyncio
+import logging
 import os
+import sys
+from typing import Awaitable, Callable, Optional
 
 import asyncpg
 from dotenv import load_dotenv
 
+logger = logging.getLogger(__name__)
+
 # Carica le variabili dal file .env
 load_dotenv()
 
@@ -10,9 +16,121 @@ DATABASE_URL = os.getenv("SUPABASE_DB_URL")
 if not DATABASE_URL:
     raise ValueError("❌ SUPABASE_DB_URL non trovata. Verifica il file .env!")
 
+# Pool settings (all overridable from .env)
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", "10"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+DB_CONN_MAX_LIFETIME = float(os.getenv("DB_CONN_MAX_LIFETIME", "1800"))  # seconds, 0 = unlimited
+DB_CONN_MAX_IDLE = float(os.getenv("DB_CONN_MAX_IDLE", "300"))  # seconds, 0 = unlimited
+# PgBouncer in transaction mode cannot keep named prepared statements across transactions
+DB_PGBOUNCER_MODE = os.getenv("DB_PGBOUNCER_MODE", "false").lower() in ("1", "true", "yes")
+
+_pool: Optional[asyncpg.Pool] = None
+_recycle_task: Optional[asyncio.Task] = None
+
+
+async def _recycle_connections(pool: asyncpg.Pool, max_lifetime: float):
+    # Periodically mark every open connection as expired: idle ones are replaced on the
+    # next acquire, busy ones as soon as they are released back to the pool.
+    while True:
+        await asyncio.sleep(max_lifetime)
+        await pool.expire_connections()
+        logger.debug("♻️ Database connections recycled")
+
+
+async def init_pool() -> asyncpg.Pool:
+    global _pool, _recycle_task
+    if _pool is not None:
+        return _pool
+
+    _pool = await asyncpg.create_pool(
+        DATABASE_URL,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        max_inactive_connection_lifetime=DB_CONN_MAX_IDLE,
+        statement_cache_size=0 if DB_PGBOUNCER_MODE else DB_STATEMENT_CACHE_SIZE,
+    )
+    if DB_CONN_MAX_LIFETIME > 0:
+        _recycle_task = asyncio.create_task(_recycle_connections(_pool, DB_CONN_MAX_LIFETIME))
+
+    logger.info(f"✅ Database pool ready (min={DB_POOL_MIN_SIZE}, max={DB_POOL_MAX_SIZE}, pgbouncer={DB_PGBOUNCER_MODE})")
+    return _pool
+
+
+async def close_pool():
+    global _pool, _recycle_task
+    if _recycle_task is not None:
+        _recycle_task.cancel()
+        _recycle_task = None
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+def run_rebuild_cli(schema: str, rebuild: Callable[[asyncpg.Connection, Optional[str]], Awaitable[int]], rows: str):
+    """
+    Command line consistency rebuild of a derived table (python holdings.py [user_id]):
+    recomputes it for one user or for everyone and logs how many `rows` were out of sync.
+    """
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format="%(asctime)s - %(levelname)s - %(message)s")
+
+    async def _main():
+        pool = await init_pool()
+        try:
+            async with pool.acquire() as conn:
+                await conn.execute(schema)
+                drift = await rebuild(conn, sys.argv[1] if len(sys.argv) > 1 else None)
+            if drift:
+                logger.warning(f"⚠️ {drift} {rows} were out of sync and have been rebuilt")
+            else:
+                logger.info(f"✅ {rows.capitalize()} rebuilt, all in sync")
+        finally:
+            await close_pool()
+
+    asyncio.run(_main())
+
+
+def get_pool() -> asyncpg.Pool:
+    if _pool is None:
+        raise RuntimeError("Database pool not initialized, call init_pool() first")
+    return _pool
+
+
+async def lock_user_data(conn, user_id: str):
+    """
+    Serializes, until the end of the current DB transaction, the writes of one user's data.
+    Every write transaction takes it as its first statement, before locking any row (target
+    rows, data_versions, derived tables), so two writes of the same user queue here instead of
+    waiting on each other's rows in opposite order. Re-entrant within the transaction: the
+    holdings/cashflow syncs take it again as a safeguard.
+    """
+    await conn.execute("SELECT pg_advisory_xact_lock(hashtext('user_data'), hashtext($1))", str(user_id))
+
+
 async def get_db():
-    conn = await asyncpg.connect(DATABASE_URL)
-    try:
+    async with get_pool().acquire(timeout=DB_POOL_ACQUIRE_TIMEOUT) as conn:
         yield conn
-    finally:
-        await conn.close()
\ No newline at end of file
+
+
+class SerializedConnection:
+    """
+    Lets concurrent coroutines share one connection, and so one transaction/snapshot.
+    asyncpg runs a single query at a time per connection, so queries wait their turn on a lock.
+    """
+
+    def __init__(self, conn: asyncpg.Connection):
+        self._conn = conn
+        self._lock = asyncio.Lock()
+
+    async def fetch(self, *args, **kwargs):
+        async with self._lock:
+            return await self._conn.fetch(*args, **kwargs)
+
+    async def fetchrow(self, *args, **kwargs):
+        async with self._lock:
+            return await self._conn.fetchrow(*args, **kwargs)
+
+    async def fetchval(self, *args, **kwargs):
+        async with self._lock:
+            return await self._conn.fetchval(*args, **kwargs)
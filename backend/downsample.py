@@ -0,0 +1,48 @@
+import numpy as np
+
+RESOLUTIONS = ("day", "week", "month")
+
+
+def period_ends(days: np.ndarray, resolution: str) -> np.ndarray:
+    """
+    Indices of the last point of every week (Monday to Sunday) or month of a sorted
+    datetime64[D] array; every index for "day".
+    """
+    if resolution == "day" or len(days) == 0:
+        return np.arange(len(days))
+    if resolution == "week":
+        # 1970-01-01 was a Thursday: shifting by 3 days makes weeks start on Monday
+        keys = (days.astype(np.int64) + 3) // 7
+    else:
+        keys = days.astype("datetime64[M]").astype(np.int64)
+    return np.flatnonzero(np.r_[keys[1:] != keys[:-1], True])
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: indices of `threshold` points that keep the visual
+    shape of the (x, y) series. The first and last points are always kept; each bucket in
+    between keeps the point forming the largest triangle with the previously kept point
+    and the average of the next bucket.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    every = (n - 2) / (threshold - 2)
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(area))
+        indices[i + 1] = a
+    return indices
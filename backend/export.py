@@ -0,0 +1,74 @@
+import csv
+import io
+import json
+import os
+from datetime import date
+from decimal import Decimal
+from typing import Any, AsyncIterator, List
+
+from database import DB_POOL_ACQUIRE_TIMEOUT, get_pool
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+# Rows fetched per round trip of the server-side cursor, and rows per chunk sent to the client
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "500"))
+
+MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def _json_default(value: Any):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+
+async def _stream_rows(query: str, args: List[Any], columns: List[str], fmt: str) -> AsyncIterator[str]:
+    """
+    Yields the result of `query` as CSV (header first) or NDJSON, EXPORT_CHUNK_ROWS rows at a time.
+
+    The connection is taken here rather than through get_db, since it has to stay checked out
+    (with the cursor's transaction open) for as long as the response is being sent.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == "csv":
+        writer.writerow(columns)
+
+    def flush() -> str:
+        chunk = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return chunk
+
+    pending = 0
+    async with get_pool().acquire(timeout=DB_POOL_ACQUIRE_TIMEOUT) as conn:
+        async with conn.transaction(readonly=True):
+            async for record in conn.cursor(query, *args, prefetch=EXPORT_CHUNK_ROWS):
+                if fmt == "csv":
+                    writer.writerow([
+                        value.isoformat() if isinstance(value, date) else value
+                        for value in (record[c] for c in columns)
+                    ])
+                else:
+                    buffer.write(json.dumps({c: record[c] for c in columns}, default=_json_default))
+                    buffer.write("\n")
+                pending += 1
+                if pending >= EXPORT_CHUNK_ROWS:
+                    yield flush()
+                    pending = 0
+    # Also sends the CSV header of an empty export
+    if buffer.tell():
+        yield flush()
+
+
+def export_response(query: str, args: List[Any], columns: List[str], fmt: str, filename: str) -> StreamingResponse:
+    # Streams the rows of `query` as an attachment, fmt is "csv" or "ndjson"
+    if fmt not in MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(MEDIA_TYPES)}")
+    return StreamingResponse(
+        _stream_rows(query, args, columns, fmt),
+        media_type=MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt}"'},
+    )
@@ -0,0 +1,237 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import date, timedelta
+from typing import Dict, Iterable, Mapping, Optional, Tuple
+
+import asyncpg
+import market_data
+import numpy as np
+from database import DB_POOL_ACQUIRE_TIMEOUT, get_pool
+from price_history import get_price_histories
+from price_provider import QuoteSnapshot, fetch_stock_histories, run_sync
+
+logger = logging.getLogger(__name__)
+
+# How long (seconds) a rate series is kept in memory before its latest days are reloaded
+FX_SERIES_TTL = float(os.getenv("FX_SERIES_TTL", "3600"))
+# Last resort for USD when no rate at all is available (logged every time it is used)
+FALLBACK_USD_TO_EUR = 0.85
+# Currency assumed for a ticker whose quote currency cannot be looked up (not persisted)
+DEFAULT_QUOTE_CURRENCY = "USD"
+# Seconds before a failed quote currency lookup (e.g. a delisted ticker) is tried again
+QUOTE_CURRENCY_RETRY_AFTER = float(os.getenv("QUOTE_CURRENCY_RETRY_AFTER", "3600"))
+
+# Currencies Yahoo Finance quotes in minor units, e.g. pence for London listings
+MINOR_UNITS = {"GBp": ("GBP", 0.01), "GBX": ("GBP", 0.01), "ZAc": ("ZAR", 0.01), "ILA": ("ILS", 0.01)}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ticker_currencies (
+    ticker TEXT PRIMARY KEY,
+    currency TEXT NOT NULL,
+    fetched_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+"""
+
+
+async def ensure_schema(conn: asyncpg.Connection):
+    await conn.execute(SCHEMA)
+
+
+def normalize_currency(currency: str) -> Tuple[str, float]:
+    # "GBp" -> ("GBP", 0.01): the ISO currency and the factor that turns a quote into it
+    if currency in MINOR_UNITS:
+        return MINOR_UNITS[currency]
+    return currency.upper(), 1.0
+
+
+class FxSeries:
+    """
+    Daily rates from one currency to EUR, sorted by date.
+
+    Lookups are as-of (the last rate on or before the day, found by binary search); days
+    before the first known rate use that first rate.
+    """
+
+    def __init__(self, rates: Mapping[date, float]):
+        items = sorted((d, r) for d, r in rates.items() if r)
+        self.days = np.fromiter((d.toordinal() for d, _ in items), dtype=np.int64, count=len(items))
+        self.rates = np.fromiter((r for _, r in items), dtype=float, count=len(items))
+
+    def __len__(self) -> int:
+        return len(self.rates)
+
+    def rate_at(self, day: date) -> Optional[float]:
+        if not len(self):
+            return None
+        i = int(np.searchsorted(self.days, day.toordinal(), side="right")) - 1
+        return float(self.rates[max(i, 0)])
+
+    def rates_at(self, days: np.ndarray) -> np.ndarray:
+        # Vectorized rate_at over an array of ordinals
+        i = np.searchsorted(self.days, days, side="right") - 1
+        return self.rates[np.clip(i, 0, None)]
+
+    def latest(self) -> Optional[float]:
+        return float(self.rates[-1]) if len(self) else None
+
+
+class FxService:
+    """
+    In-memory cache of FxSeries per currency, loaded from the price_history store (which
+    downloads only the missing days of the EUR/<currency> Yahoo Finance series).
+    Uses its own pooled connection, so it also works under read-only request transactions;
+    callers already hold one, so when the pool stays exhausted the last series (or none) is
+    returned instead of waiting for it.
+    """
+
+    def __init__(self, ttl: float = FX_SERIES_TTL):
+        self.ttl = ttl
+        self._series: Dict[str, Tuple[FxSeries, date, float]] = {}  # currency -> (series, start, loaded_at)
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    async def series(self, currency: str, start: date) -> FxSeries:
+        if currency == "EUR":
+            return FxSeries({date.min: 1.0})
+        cached = self._series.get(currency)
+        if cached is not None and cached[1] <= start and time.monotonic() - cached[2] < self.ttl:
+            return cached[0]
+
+        async with self._locks.setdefault(currency, asyncio.Lock()):
+            cached = self._series.get(currency)
+            if cached is not None and cached[1] <= start and time.monotonic() - cached[2] < self.ttl:
+                return cached[0]
+            start = min(start, cached[1]) if cached is not None else start
+            symbol = market_data.fx_symbol(currency)
+            try:
+                async with get_pool().acquire(timeout=DB_POOL_ACQUIRE_TIMEOUT) as conn:
+                    histories = await get_price_histories(
+                        conn, [symbol], "yfinance", start, date.today(), fetch_stock_histories
+                    )
+            except asyncio.TimeoutError:
+                # Not cached, the next call tries again
+                logger.warning(f"⚠️ No DB connection to load the {currency}/EUR rates, using the last ones")
+                return cached[0] if cached is not None else FxSeries({})
+            closes = histories.get(symbol.upper(), {})
+            series = FxSeries({d: 1 / close for d, close in closes.items() if close})
+            if not len(series):
+                logger.warning(f"⚠️ No {currency}/EUR rates available from {start}")
+            self._series[currency] = (series, start, time.monotonic())
+            return series
+
+    async def to_eur(
+        self, prices: Mapping[str, Mapping[date, float]], currencies: Mapping[str, str], start: date
+    ) -> Dict[str, Dict[date, float]]:
+        """
+        Converts {ticker: {date: price}} series to EUR, each quote at the rate of its own date,
+        given the quote currency of every ticker. Tickers whose currency has no rates are left out.
+        """
+        needed = {normalize_currency(currencies[t])[0] for t in prices}
+        series = dict(zip(needed, await asyncio.gather(*(self.series(c, start) for c in needed))))
+
+        converted = {}
+        for ticker, points in prices.items():
+            currency, factor = normalize_currency(currencies[ticker])
+            fx = series[currency]
+            if not len(fx):
+                if currency != "USD":
+                    logger.warning(f"⚠️ {ticker} left out: no {currency}/EUR rates")
+                    continue
+                logger.warning(f"⚠️ Using the fallback USD/EUR rate for {ticker}")
+                fx = FxSeries({date.min: FALLBACK_USD_TO_EUR})
+            days = np.fromiter((d.toordinal() for d in points), dtype=np.int64, count=len(points))
+            values = np.fromiter(points.values(), dtype=float, count=len(points)) * factor * fx.rates_at(days)
+            converted[ticker] = dict(zip(points.keys(), values.tolist()))
+        return converted
+
+
+fx_service = FxService()
+
+# Quote currency of every ticker looked up so far (TICKER -> currency as given by Yahoo)
+_currencies: Dict[str, str] = {}
+# Tickers whose lookup failed, until they may be looked up again (TICKER -> monotonic time)
+_lookup_retry_at: Dict[str, float] = {}
+
+
+async def quote_currencies(tickers: Iterable[str]) -> Dict[str, str]:
+    """
+    Quote currency of each Yahoo Finance ticker, as {ticker: currency}.
+
+    Read from memory, then from the ticker_currencies table, then from Yahoo Finance
+    (concurrently, and stored for next time). Lookups that fail, or that find the DB pool
+    exhausted, fall back to USD for now; a failed Yahoo Finance lookup is not repeated for
+    QUOTE_CURRENCY_RETRY_AFTER seconds.
+    """
+    tickers = list(dict.fromkeys(tickers))
+    now = time.monotonic()
+    missing = [
+        t.upper() for t in tickers
+        if t.upper() not in _currencies and _lookup_retry_at.get(t.upper(), 0) <= now
+    ]
+    if missing:
+        try:
+            await _load_currencies(missing)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ No DB connection to look up the quote currency of {missing}")
+    return {t: _currencies.get(t.upper(), DEFAULT_QUOTE_CURRENCY) for t in tickers}
+
+
+async def _load_currencies(missing: list):
+    # Quote currencies not in memory: from the table, else from Yahoo Finance (then stored)
+    async with get_pool().acquire(timeout=DB_POOL_ACQUIRE_TIMEOUT) as conn:
+        rows = await conn.fetch(
+            "SELECT ticker, currency FROM ticker_currencies WHERE ticker = ANY($1::text[])", missing
+        )
+        _currencies.update({r["ticker"]: r["currency"] for r in rows})
+        missing = [t for t in missing if t not in _currencies]
+        if missing:
+            results = await asyncio.gather(
+                *(run_sync(market_data.fetch_quote_currency, t) for t in missing), return_exceptions=True
+            )
+            found = [(t, c) for t, c in zip(missing, results) if isinstance(c, str)]
+            retry_at = time.monotonic() + QUOTE_CURRENCY_RETRY_AFTER
+            _lookup_retry_at.update((t, retry_at) for t, c in zip(missing, results) if not isinstance(c, str))
+            if found:
+                await conn.executemany(
+                    """
+                    INSERT INTO ticker_currencies (ticker, currency) VALUES ($1, $2)
+                    ON CONFLICT (ticker) DO UPDATE SET currency = EXCLUDED.currency, fetched_at = now()
+                    """,
+                    found,
+                )
+                _currencies.update(found)
+
+
+async def current_rates(quotes: QuoteSnapshot, currencies: Iterable[str]) -> Dict[str, Optional[float]]:
+    # Live (or published) rate of each currency, else the last stored one
+    currencies = list(dict.fromkeys(currencies))
+    live = await asyncio.gather(*(quotes.fx_rate(c) for c in currencies))
+    rates = {}
+    for currency, rate in zip(currencies, live):
+        if rate is None:
+            series = await fx_service.series(currency, date.today() - timedelta(days=30))
+            rate = series.latest()
+        if rate is None and currency == "USD":
+            logger.warning("⚠️ Using the fallback USD/EUR rate")
+            rate = FALLBACK_USD_TO_EUR
+        rates[currency] = rate
+    return rates
+
+
+async def stock_prices_eur(quotes: QuoteSnapshot, tickers: Dict[str, str]) -> Dict[str, float]:
+    """
+    Last close of each stock/ETF ({ticker: asset_type}) converted to EUR from its own quote
+    currency. Tickers without a quote or without a rate are missing from the result.
+    """
+    native, currencies = await asyncio.gather(quotes.stock_prices(tickers), quote_currencies(tickers))
+    rates = await current_rates(quotes, {normalize_currency(currencies[t])[0] for t in native})
+    prices = {}
+    for ticker, price in native.items():
+        currency, factor = normalize_currency(currencies[ticker])
+        if rates[currency] is None:
+            logger.warning(f"⚠️ {ticker} left out: no {currency}/EUR rate")
+            continue
+        prices[ticker] = price * factor * rates[currency]
+    return prices
+
@@ -0,0 +1,127 @@
+import logging
+from typing import Iterable, Optional, Tuple
+
+import asyncpg
+from database import lock_user_data, run_rebuild_cli
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS holdings (
+    user_id UUID NOT NULL,
+    asset_type TEXT NOT NULL,
+    ticker TEXT NOT NULL,
+    net_quantity NUMERIC NOT NULL,
+    cost_basis NUMERIC NOT NULL,
+    last_op_date DATE,
+    PRIMARY KEY (user_id, asset_type, ticker)
+);
+
+CREATE INDEX IF NOT EXISTS investments_holding_idx
+    ON investments (user_id, upper(ticker), lower(asset_type));
+"""
+
+# Net quantity, cost and last operation of every (user, asset type, ticker) matching {where}.
+# Asset types are stored lowercase and tickers uppercase; the cost basis is the average buy
+# price times the quantity still held.
+HOLDINGS_QUERY = """
+    SELECT user_id, asset_type, ticker, net_quantity,
+           CASE WHEN net_quantity > 0 AND buy_quantity > 0
+                THEN buy_value * net_quantity / buy_quantity
+                ELSE 0
+           END AS cost_basis,
+           last_op_date
+    FROM (
+        SELECT user_id, lower(asset_type) AS asset_type, upper(ticker) AS ticker,
+               COALESCE(SUM(CASE lower(type_of_operation)
+                   WHEN 'buy' THEN COALESCE(quantity, 0)
+                   WHEN 'sell' THEN -COALESCE(quantity, 0)
+                   ELSE 0
+               END), 0) AS net_quantity,
+               COALESCE(SUM(quantity) FILTER (WHERE lower(type_of_operation) = 'buy'), 0) AS buy_quantity,
+               COALESCE(SUM(total_value) FILTER (WHERE lower(type_of_operation) = 'buy'), 0) AS buy_value,
+               MAX(date_of_operation) AS last_op_date
+        FROM investments
+        WHERE asset_type IS NOT NULL AND ticker IS NOT NULL AND {where}
+        GROUP BY user_id, lower(asset_type), upper(ticker)
+    ) ops
+"""
+
+HoldingKey = Tuple[str, str]
+
+
+async def ensure_schema(conn: asyncpg.Connection):
+    created = await conn.fetchval("SELECT to_regclass('holdings') IS NULL")
+    await conn.execute(SCHEMA)
+    if created:
+        # First start with the table: fill it from the existing investments
+        filled = await rebuild(conn)
+        logger.info(f"✅ Holdings table created with {filled} holdings")
+
+
+def holding_key(asset_type: str, ticker: str) -> HoldingKey:
+    return asset_type.lower(), ticker.upper()
+
+
+async def sync(conn: asyncpg.Connection, user_id: str, keys: Iterable[HoldingKey]):
+    """
+    Recomputes the holdings of the given (asset_type, ticker) keys from their operations.
+    Called by every write on investments, inside the same DB transaction, with the keys of
+    both the old and the new version of the touched rows.
+    """
+    keys = {holding_key(*k) for k in keys if k[0] and k[1]}
+    if not keys:
+        return
+    asset_types, tickers = [k[0] for k in keys], [k[1] for k in keys]
+    # Concurrent writes of the same user would both re-insert the same keys
+    await lock_user_data(conn, user_id)
+    await conn.execute(
+        """
+        DELETE FROM holdings
+        WHERE user_id = $1 AND (asset_type, ticker) IN (SELECT * FROM unnest($2::text[], $3::text[]))
+        """,
+        user_id, asset_types, tickers,
+    )
+    where = "user_id = $1 AND (lower(asset_type), upper(ticker)) IN (SELECT * FROM unnest($2::text[], $3::text[]))"
+    await conn.execute(
+        f"INSERT INTO holdings (user_id, asset_type, ticker, net_quantity, cost_basis, last_op_date) "
+        f"{HOLDINGS_QUERY.format(where=where)}",
+        user_id, asset_types, tickers,
+    )
+
+
+async def clear(conn: asyncpg.Connection, user_id: str):
+    # For the endpoints that delete every investment of the user
+    await conn.execute("DELETE FROM holdings WHERE user_id = $1", user_id)
+
+
+async def rebuild(conn: asyncpg.Connection, user_id: Optional[str] = None) -> int:
+    """
+    Consistency rebuild: recomputes the holdings of one user (or of everyone) from the
+    investments table. Returns how many holdings were out of sync before the rebuild.
+    """
+    where, args = ("user_id = $1", [user_id]) if user_id else ("TRUE", [])
+    async with conn.transaction():
+        await conn.execute(
+            f"CREATE TEMP TABLE holdings_rebuild ON COMMIT DROP AS {HOLDINGS_QUERY.format(where=where)}",
+            *args,
+        )
+        drift = await conn.fetchval(
+            f"""
+            SELECT COUNT(*)
+            FROM (SELECT * FROM holdings WHERE {where}) h
+            FULL JOIN holdings_rebuild r USING (user_id, asset_type, ticker)
+            WHERE h.net_quantity IS DISTINCT FROM r.net_quantity
+               OR h.cost_basis IS DISTINCT FROM r.cost_basis
+               OR h.last_op_date IS DISTINCT FROM r.last_op_date
+            """,
+            *args,
+        )
+        await conn.execute(f"DELETE FROM holdings WHERE {where}", *args)
+        await conn.execute("INSERT INTO holdings SELECT * FROM holdings_rebuild")
+    return drift
+
+
+if __name__ == "__main__":
+    # Consistency rebuild: python holdings.py [user_id]
+    run_rebuild_cli(SCHEMA, rebuild, "holdings")
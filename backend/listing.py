@@ -0,0 +1,129 @@
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, List, Optional, Tuple
+
+import asyncpg
+from fastapi import HTTPException
+
+# Upper bound of a single page, whatever `limit` the client asks for
+MAX_PAGE_SIZE = 1000
+
+# Indexes backing the keyset pagination of the list endpoints
+SCHEMA = """
+CREATE INDEX IF NOT EXISTS transactions_user_date_id_idx ON transactions (user_id, transaction_date, id);
+CREATE INDEX IF NOT EXISTS transactions_user_amount_id_idx ON transactions (user_id, amount, id);
+CREATE INDEX IF NOT EXISTS investments_user_date_id_idx ON investments (user_id, date_of_operation, id);
+CREATE INDEX IF NOT EXISTS investments_user_value_id_idx ON investments (user_id, total_value, id);
+"""
+
+
+async def ensure_schema(conn: asyncpg.Connection):
+    await conn.execute(SCHEMA)
+
+
+def parse_date(value: Optional[str], name: str) -> Optional[date]:
+    if value is None:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Formato data non valido per {name}")
+
+
+def encode_cursor(sort: str, value: Any, row_id: int) -> str:
+    raw = json.dumps([sort, value.isoformat() if isinstance(value, date) else str(value), row_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str, sort: str, is_date: bool) -> Tuple[Any, int]:
+    try:
+        cursor_sort, value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if cursor_sort != sort:
+            raise ValueError("cursor created with another sort")
+        return (date.fromisoformat(value) if is_date else Decimal(value)), int(row_id)
+    except (ValueError, TypeError, InvalidOperation, json.JSONDecodeError):
+        raise HTTPException(status_code=400, detail="Cursor non valido")
+
+
+def build_list_query(
+    table: str,
+    columns: List[str],
+    sort_columns: Dict[str, str],
+    date_column: str,
+    user_id: str,
+    filters: List[Tuple[str, Any]],
+    sort: str,
+    cursor: Optional[str],
+    limit: Optional[int],
+    fields: Optional[str],
+) -> Tuple[str, List[Any], List[str], str]:
+    """
+    Builds a keyset-paginated SELECT on `table` for one user.
+
+    - sort: "<key>_asc" or "<key>_desc", with <key> in sort_columns (e.g. {"date": "transaction_date"})
+    - filters: (condition, value) pairs, `{}` in the condition is replaced by the value placeholder;
+      pairs with a None value are skipped
+    - fields: comma separated projection, restricted to `columns` (None: every column)
+    Returns the query, its arguments, the requested fields (None: all) and the sort column.
+    """
+    key, _, direction = sort.rpartition("_")
+    if key not in sort_columns or direction not in ("asc", "desc"):
+        options = ", ".join(f"{k}_{d}" for k in sort_columns for d in ("asc", "desc"))
+        raise HTTPException(status_code=400, detail=f"sort must be one of: {options}")
+    sort_column = sort_columns[key]
+
+    if fields:
+        requested = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [f for f in requested if f not in columns]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+        # id and the sort column are always read, they are needed to build the next cursor
+        selected = list(dict.fromkeys(requested + ["id", sort_column]))
+        select = ", ".join(selected)
+    else:
+        requested = None
+        select = "*"
+
+    args: List[Any] = [user_id]
+    conditions = ["user_id = $1"]
+    for condition, value in filters:
+        if value is None:
+            continue
+        args.append(value)
+        conditions.append(condition.format(f"${len(args)}"))
+
+    if cursor:
+        value, row_id = decode_cursor(cursor, sort, sort_column == date_column)
+        args.extend([value, row_id])
+        op = "<" if direction == "desc" else ">"
+        conditions.append(f"({sort_column}, id) {op} (${len(args) - 1}, ${len(args)})")
+
+    order = "DESC" if direction == "desc" else "ASC"
+    query = f"SELECT {select} FROM {table} WHERE {' AND '.join(conditions)} ORDER BY {sort_column} {order}, id {order}"
+    if limit is not None:
+        # One extra row tells whether there is a next page
+        args.append(min(max(limit, 1), MAX_PAGE_SIZE) + 1)
+        query += f" LIMIT ${len(args)}"
+    return query, args, requested, sort_column
+
+
+def build_page(
+    records: List[asyncpg.Record],
+    sort: str,
+    sort_column: str,
+    limit: Optional[int],
+    requested: Optional[List[str]],
+) -> Tuple[List[dict], Optional[str]]:
+    # Trims the look-ahead row, builds the next cursor and applies the projection
+    next_cursor = None
+    if limit is not None:
+        page_size = min(max(limit, 1), MAX_PAGE_SIZE)
+        if len(records) > page_size:
+            records = records[:page_size]
+            last = records[-1]
+            next_cursor = encode_cursor(sort, last[sort_column], last["id"])
+    if requested is None:
+        return [dict(r) for r in records], next_cursor
+    return [{f: r[f] for f in requested} for r in records], next_cursor
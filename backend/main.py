@@ -1,20 +1,84 @@
+import asyncio
 import logging
-from collections import defaultdict
+from contextlib import asynccontextmanager
 from datetime import date, datetime, timedelta
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Union
 
 import asyncpg
-import yfinance as yf
+import numpy as np
 from auth import verify_token
-from database import get_db
+from batch import run_batch
+from bulk_import import ensure_schema as ensure_import_schema
+from bulk_import import import_investments, import_transactions
+from cashflow import balance_as_of
+from cashflow import clear as clear_cashflow
+from cashflow import ensure_schema as ensure_cashflow_schema
+from cashflow import sync as sync_cashflow
+from coin_index import coin_index
+from coin_index import run_refresher as run_coin_index_refresher
+from database import SerializedConnection, close_pool, get_db, init_pool, lock_user_data
 from dateutil.relativedelta import relativedelta
-from fastapi import Depends, FastAPI, HTTPException, status
+from downsample import RESOLUTIONS, lttb, period_ends
+from export import export_response
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from pycoingecko import CoinGeckoAPI
+from listing import build_list_query, build_page
+from listing import ensure_schema as ensure_listing_schema
+from listing import parse_date
+from fx import ensure_schema as ensure_fx_schema
+from fx import stock_prices_eur
+from holdings import clear as clear_holdings
+from holdings import ensure_schema as ensure_holdings_schema
+from holdings import sync as sync_holdings
+from price_cache import price_cache
+from price_history import ensure_schema as ensure_price_history_schema
+from price_provider import QuoteSnapshot, published_prices, validate_ticker
+from price_scheduler import run_scheduler as run_price_scheduler
 from pydantic import BaseModel
+from result_cache import result_cache
+from snapshots import ensure_fresh as ensure_snapshots_fresh
+from snapshots import ensure_schema as ensure_snapshots_schema
+from snapshots import get_snapshots
+from snapshots import invalidate as invalidate_snapshots
+from snapshots import mark_dirty as mark_snapshots_dirty
+from snapshots import run_nightly as run_snapshots_nightly
+from versions import SCOPES as DATA_SCOPES
+from versions import ConditionalGet
+from versions import bump as bump_versions
+from versions import ensure_schema as ensure_versions_schema
+from versions import get_versions
 
 logger = logging.getLogger(__name__)
-app = FastAPI()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open the shared connection pool once per process
+    pool = await init_pool()
+    async with pool.acquire() as conn:
+        await ensure_price_history_schema(conn)
+        await ensure_fx_schema(conn)
+        await ensure_snapshots_schema(conn)
+        await ensure_listing_schema(conn)
+        await ensure_import_schema(conn)
+        await ensure_holdings_schema(conn)
+        await ensure_cashflow_schema(conn)
+        await ensure_versions_schema(conn)
+    await asyncio.to_thread(coin_index.load)
+    background_tasks = [
+        asyncio.create_task(run_coin_index_refresher()),
+        asyncio.create_task(run_snapshots_nightly()),
+        asyncio.create_task(run_price_scheduler()),
+    ]
+    try:
+        yield
+    finally:
+        for task in background_tasks:
+            task.cancel()
+        await close_pool()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 
@@ -28,6 +92,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
 
@@ -85,44 +150,31 @@ class CategoryCreate(BaseModel):
     icon: str
 
 
+# Batch operation model ("id"/"category_id" can be "$<n>": the id created by operation n)
+class BatchOperation(BaseModel):
+    op: str                        # "create", "update" o "delete"
+    entity: str                    # "transactions", "investments" o "categories"
+    id: Optional[Union[int, str]] = None
+    data: Optional[Dict[str, Any]] = None
 
 
-########################
-### Helper functions ###
-########################
+# Batch model
+class BatchRequest(BaseModel):
+    operations: List[BatchOperation]
 
-# Function to validate a ticker symbol using yfinance
-def validate_ticker_yfinance(ticker: str) -> bool:
-    try:
-        if not ticker:
-            return False
-        ticker_obj = yf.Ticker(ticker)
-        # Attempt to download data to see if the ticker is valid.
-        # If the ticker is invalid, yfinance might return empty data.
-        hist = ticker_obj.history(period="1d")
-        if hist.empty:
-            return False
-        return True
-    except Exception:
-        return False
-
-
-# Function to validate a ticker symbol using CoinGecko
-def validate_ticker_coingecko(ticker: str) -> bool:
-    try:
-        if not ticker:
-            return False
-        cg = CoinGeckoAPI()
-        # Attempt a search on CoinGecko by coin symbol or name.
-        # We'll do a simple search. If no match, it's invalid.
-        search_result = cg.search(query=ticker)
-        # search_result is a dict with keys like 'coins', 'exchanges', etc.
-        if not search_result or "coins" not in search_result:
-            return False
-        # We can consider it valid if at least one coin matches the search.
-        return len(search_result["coins"]) > 0
-    except Exception:
-        return False
+
+# Sections of GET /dashboard, in response order
+DASHBOARD_SECTIONS = [
+    "networth", "finance_composition", "expenses_by_category", "monthly_finances",
+    "networth_history", "transactions", "investments",
+]
+
+# Columns that can be requested with fields= on the list endpoints
+TRANSACTION_FIELDS = ["id", "type", "amount", "description", "category_id", "transaction_date"]
+INVESTMENT_FIELDS = [
+    "id", "type_of_operation", "asset_type", "ticker", "full_name", "quantity",
+    "total_value", "date_of_operation", "exchange", "transaction_id",
+]
 
 
 
@@ -137,63 +189,189 @@ def home():
     return {"message": "Backend is up!"}
 
 
+# GET endpoint to expose the hit/miss counters of the result and price caches
+@app.get("/cache-stats")
+def cache_stats(user_id: str = Depends(verify_token)):
+    return {"result_cache": result_cache.stats(), "price_cache": price_cache.stats()}
+
+
 # GET endpoint to fetch transactions
 @app.get("/transactions")
 async def get_transactions(
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    type: Optional[str] = None,
+    category_id: Optional[int] = None,
+    amount_min: Optional[float] = None,
+    amount_max: Optional[float] = None,
+    sort: str = "date_desc",
+    fields: Optional[str] = None,
+    not_modified: None = Depends(ConditionalGet("transactions")),
     user_id: str = Depends(verify_token),
     db: asyncpg.Connection = Depends(get_db)
 ):
-    query = "SELECT * FROM transactions WHERE user_id = $1 ORDER BY transaction_date DESC"
-    transactions = await db.fetch(query, user_id)
-    return {"transactions": [dict(t) for t in transactions]}
+    """
+    Lists the user's transactions. Without `limit` every matching row is returned; with it,
+    pages follow `next_cursor` (keyset on the sort column and id).
+    """
+    query, args, requested, sort_column = build_list_query(
+        "transactions",
+        TRANSACTION_FIELDS,
+        {"date": "transaction_date", "amount": "amount"},
+        "transaction_date",
+        user_id,
+        [
+            ("transaction_date >= {}", parse_date(date_from, "date_from")),
+            ("transaction_date <= {}", parse_date(date_to, "date_to")),
+            ("type = {}", type),
+            ("category_id = {}", category_id),
+            ("amount >= {}", amount_min),
+            ("amount <= {}", amount_max),
+        ],
+        sort, cursor, limit, fields,
+    )
+    transactions = await db.fetch(query, *args)
+    items, next_cursor = build_page(transactions, sort, sort_column, limit, requested)
+    return {"transactions": items, "next_cursor": next_cursor}
 
 
 # GET endpoint to fetch investments
 @app.get("/investments")
 async def get_investments(
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    type_of_operation: Optional[str] = None,
+    asset_type: Optional[str] = None,
+    ticker: Optional[str] = None,
+    value_min: Optional[float] = None,
+    value_max: Optional[float] = None,
+    sort: str = "date_desc",
+    fields: Optional[str] = None,
+    not_modified: None = Depends(ConditionalGet("investments")),
     user_id: str = Depends(verify_token),
     db: asyncpg.Connection = Depends(get_db)
 ):
-    query = "SELECT * FROM investments WHERE user_id = $1 ORDER BY date_of_operation DESC"
-    investments = await db.fetch(query, user_id)
-    return {"investments": [dict(t) for t in investments]}
+    """
+    Lists the user's investments, same paging rules as GET /transactions.
+    """
+    query, args, requested, sort_column = build_list_query(
+        "investments",
+        INVESTMENT_FIELDS,
+        {"date": "date_of_operation", "value": "total_value"},
+        "date_of_operation",
+        user_id,
+        [
+            ("date_of_operation >= {}", parse_date(date_from, "date_from")),
+            ("date_of_operation <= {}", parse_date(date_to, "date_to")),
+            ("type_of_operation = {}", type_of_operation),
+            ("asset_type = {}", asset_type),
+            ("upper(ticker) = upper({})", ticker),
+            ("total_value >= {}", value_min),
+            ("total_value <= {}", value_max),
+        ],
+        sort, cursor, limit, fields,
+    )
+    investments = await db.fetch(query, *args)
+    items, next_cursor = build_page(investments, sort, sort_column, limit, requested)
+    return {"investments": items, "next_cursor": next_cursor}
+
+
+# GET endpoint to export transactions (streamed)
+@app.get("/transactions/export")
+async def export_transactions(
+    format: str = "csv",
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    sort: str = "date_asc",
+    fields: Optional[str] = None,
+    user_id: str = Depends(verify_token),
+):
+    """
+    Streams the user's transactions as CSV or NDJSON (format=csv|ndjson), read from a server-side cursor.
+    """
+    query, args, requested, _ = build_list_query(
+        "transactions",
+        TRANSACTION_FIELDS,
+        {"date": "transaction_date", "amount": "amount"},
+        "transaction_date",
+        user_id,
+        [
+            ("transaction_date >= {}", parse_date(date_from, "date_from")),
+            ("transaction_date <= {}", parse_date(date_to, "date_to")),
+        ],
+        sort, None, None, fields or ",".join(TRANSACTION_FIELDS),
+    )
+    return export_response(query, args, requested, format, "transactions")
 
 
-# GET endpoint to fetch account data and compute net worth
-@app.get("/networth")
-async def get_networth(
+# GET endpoint to export investments (streamed)
+@app.get("/investments/export")
+async def export_investments(
+    format: str = "csv",
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    sort: str = "date_asc",
+    fields: Optional[str] = None,
     user_id: str = Depends(verify_token),
-    db: asyncpg.Connection = Depends(get_db)
 ):
-    # Get current USD to EUR exchange rate
-    def get_usd_to_eur():
-        try:
-            eur_usd = yf.Ticker("EURUSD=X").history(period="1d")
-            if not eur_usd.empty:
-                rate = 1 / eur_usd["Close"].iloc[-1]
-                return round(rate, 4)
-            return 0.85  # Fallback rate
-        except Exception:
-            return 0.85
+    """
+    Streams the user's investments as CSV or NDJSON, same parameters as GET /transactions/export.
+    """
+    query, args, requested, _ = build_list_query(
+        "investments",
+        INVESTMENT_FIELDS,
+        {"date": "date_of_operation", "value": "total_value"},
+        "date_of_operation",
+        user_id,
+        [
+            ("date_of_operation >= {}", parse_date(date_from, "date_from")),
+            ("date_of_operation <= {}", parse_date(date_to, "date_to")),
+        ],
+        sort, None, None, fields or ",".join(INVESTMENT_FIELDS),
+    )
+    return export_response(query, args, requested, format, "investments")
+
 
-    usd_to_eur = get_usd_to_eur()
+# Result of a computed endpoint, served from memory while the user's data (and, for
+# valuations, the published prices) stay the same
+async def cached_result(db, user_id: str, endpoint: str, params: Dict[str, Any], compute, prices: bool = False):
+    versions = await get_versions(db, user_id, DATA_SCOPES)
+    price_id = None
+    if prices:
+        published = published_prices()
+        # Without fresh published prices the quotes are live: only the TTL bounds them
+        price_id = published.version if published.fresh else "live"
+    key = (user_id, endpoint, tuple(sorted(params.items())), versions, price_id, date.today())
+    return await result_cache.get_or_compute(key, compute)
 
+
+# Net worth summary, shared by GET /networth and GET /dashboard
+async def compute_networth(db, user_id: str, quotes: QuoteSnapshot):
     today = date.today() + timedelta(days=1)
     start_30 = today - timedelta(days=30)
     start_60 = today - timedelta(days=60)
 
-    async def get_sum(start_date, end_date, trx_type):
-        query = """
-            SELECT COALESCE(SUM(amount), 0)
-            FROM transactions
-            WHERE user_id = $1 AND type = $2 AND transaction_date >= $3 AND transaction_date < $4
-        """
-        return await db.fetchval(query, user_id, trx_type, start_date, end_date)
-
-    income_30 = await get_sum(start_30, today, "income")
-    income_60 = await get_sum(start_60, start_30, "income")
-    expense_30 = await get_sum(start_30, today, "expense")
-    expense_60 = await get_sum(start_60, start_30, "expense")
+    # 1st round trip: the four income/expense windows (from the daily rollup) and the initial balance
+    sums_query = """
+        SELECT
+            COALESCE(SUM(income) FILTER (WHERE day >= $2), 0) AS income_30,
+            COALESCE(SUM(income) FILTER (WHERE day < $2), 0) AS income_60,
+            COALESCE(SUM(expense) FILTER (WHERE day >= $2), 0) AS expense_30,
+            COALESCE(SUM(expense) FILTER (WHERE day < $2), 0) AS expense_60,
+            COALESCE((SELECT initial_balance FROM accounts WHERE user_id = $1 LIMIT 1), 0) AS initial_balance
+        FROM cashflow_daily
+        WHERE user_id = $1 AND day >= $3 AND day < $4
+    """
+    sums = await db.fetchrow(sums_query, user_id, start_30, start_60, today)
+    income_30 = float(sums["income_30"])
+    income_60 = float(sums["income_60"])
+    expense_30 = float(sums["expense_30"])
+    expense_60 = float(sums["expense_60"])
+    initial_balance = float(sums["initial_balance"])
 
     def percentage_change(current, previous):
         if previous == 0:
@@ -203,68 +381,63 @@ async def get_networth(
     income_change = percentage_change(income_30, income_60)
     expense_change = percentage_change(expense_30, expense_60)
 
-    investments_query = """
-        SELECT asset_type, ticker, quantity, type_of_operation, date_of_operation
-        FROM investments
-        WHERE user_id = $1
+    # 2nd round trip: net quantity per ticker today and 30 days ago, from the maintained
+    # holdings minus the operations of the last 30 days (and any dated after tomorrow)
+    positions_query = """
+        SELECT
+            h.ticker,
+            h.asset_type,
+            h.net_quantity - COALESCE(ops.qty_after, 0) AS qty_now,
+            h.net_quantity - COALESCE(ops.qty_since, 0) AS qty_30
+        FROM holdings h
+        LEFT JOIN (
+            SELECT lower(asset_type) AS asset_type, upper(ticker) AS ticker,
+                   SUM(signed_qty) AS qty_since,
+                   SUM(signed_qty) FILTER (WHERE date_of_operation >= $3) AS qty_after
+            FROM (
+                SELECT asset_type, ticker, date_of_operation,
+                       CASE lower(type_of_operation)
+                           WHEN 'buy' THEN COALESCE(quantity, 0)
+                           WHEN 'sell' THEN -COALESCE(quantity, 0)
+                           ELSE 0
+                       END AS signed_qty
+                FROM investments
+                WHERE user_id = $1 AND date_of_operation >= $2
+            ) recent
+            GROUP BY 1, 2
+        ) ops USING (asset_type, ticker)
+        WHERE h.user_id = $1
     """
-    raw_investments = await db.fetch(investments_query, user_id)
+    position_rows = await db.fetch(positions_query, user_id, start_30, today + timedelta(days=1))
+    pos_now = {r["ticker"]: {"asset_type": r["asset_type"], "net_quantity": float(r["qty_now"])} for r in position_rows}
+    pos_30 = {r["ticker"]: {"asset_type": r["asset_type"], "net_quantity": float(r["qty_30"])} for r in position_rows}
+
+    # Price every ticker held at either date with one batch per provider, concurrently
+    held = {r["ticker"]: r["asset_type"] for r in position_rows if r["qty_now"] > 0 or r["qty_30"] > 0}
+    stock_prices, crypto_prices = await asyncio.gather(
+        stock_prices_eur(quotes, {t: a for t, a in held.items() if a in ["stock", "etf"]}),
+        quotes.crypto_prices([t for t, a in held.items() if a == "crypto"]),
+    )
 
-    from collections import defaultdict
-    def compute_positions(as_of_date):
-        positions = defaultdict(lambda: {"asset_type": "", "net_quantity": 0.0})
-        for inv in raw_investments:
-            if inv["date_of_operation"] >= as_of_date:
-                continue
-            operation = inv["type_of_operation"]
-            if operation is None:
-                continue
-            key = inv["ticker"]
-            q = 0.0 if inv["quantity"] is None else float(inv["quantity"])
-            if operation.lower() == "buy":
-                positions[key]["net_quantity"] += q
-            elif operation.lower() == "sell":
-                positions[key]["net_quantity"] -= q
-            positions[key]["asset_type"] = inv["asset_type"]
-        return positions
-
-    async def get_investment_value(positions):
+    def get_investment_value(positions):
         total_value = 0.0
-        cg = CoinGeckoAPI()
-        
         for ticker, data in positions.items():
             quantity = data["net_quantity"]
-            asset_type = data["asset_type"]
+            asset_type = data["asset_type"].lower()
             if quantity <= 0:
                 continue
-            try:
-                if asset_type.lower() in ["stock", "etf"]:
-                    # Get USD price and convert to EUR
-                    usd_price = yf.Ticker(ticker).history(period="1d")["Close"][-1]
-                    eur_price = usd_price * usd_to_eur
-                    total_value += eur_price * quantity
-                elif asset_type.lower() == "crypto":
-                    # Get direct EUR price
-                    result = cg.search(query=ticker)
-                    coins = result.get("coins", [])
-                    if not coins:
-                        continue
-                    coin_id = coins[0]["id"]
-                    market_data = cg.get_price(ids=coin_id, vs_currencies="eur")
-                    total_value += market_data[coin_id]["eur"] * quantity
-            except Exception as e:
-                logger.warning(f"⚠️ Price check failed for {ticker}: {e}")
-                continue
+            if asset_type in ["stock", "etf"] and ticker in stock_prices:
+                # Price converted to EUR from the ticker's quote currency
+                total_value += stock_prices[ticker] * quantity
+            elif asset_type == "crypto" and ticker in crypto_prices:
+                # Direct EUR price
+                total_value += crypto_prices[ticker] * quantity
+            else:
+                logger.warning(f"⚠️ Price check failed for {ticker}")
         return total_value
 
-    pos_now = compute_positions(today + timedelta(days=1))
-    pos_30 = compute_positions(start_30)
-    inv_value_now = await get_investment_value(pos_now)
-    inv_value_30 = await get_investment_value(pos_30)
-
-    initial_balance = await db.fetchval(
-        "SELECT COALESCE((SELECT initial_balance FROM accounts WHERE user_id = $1 LIMIT 1), 0)", user_id
-    )
+    inv_value_now = get_investment_value(pos_now)
+    inv_value_30 = get_investment_value(pos_30)
 
     networth_now = float(initial_balance) + float(income_30) - float(expense_30) + float(inv_value_now) 
     networth_prev = float(initial_balance) + float(income_60) - float(expense_60) + float(inv_value_30)
@@ -281,9 +454,19 @@ async def get_networth(
         "investment_value_30_days_ago": round(inv_value_30, 2)
     }
 
+
+# GET endpoint to fetch account data and compute net worth
+@app.get("/networth")
+async def get_networth(
+    user_id: str = Depends(verify_token),
+    db: asyncpg.Connection = Depends(get_db)
+):
+    return await cached_result(db, user_id, "networth", {}, lambda: compute_networth(db, user_id, QuoteSnapshot()), prices=True)
+
 # GET endpoint to fetch categories
 @app.get("/categories")
 async def get_categories(
+    not_modified: None = Depends(ConditionalGet("categories")),
     user_id: str = Depends(verify_token),
     db: asyncpg.Connection = Depends(get_db)
 ):
@@ -297,6 +480,60 @@ async def get_categories(
     return [dict(r) for r in records]
 
 
+# GET endpoint to fetch every homepage section in one round trip
+@app.get("/dashboard")
+async def get_dashboard(
+    sections: Optional[str] = None,
+    range_days: int = 90,
+    months: int = 6,
+    granularity: str = "month",
+    limit: int = 20,
+    user_id: str = Depends(verify_token),
+    db: asyncpg.Connection = Depends(get_db)
+):
+    """
+    Computes the requested sections (comma separated, default all: see DASHBOARD_SECTIONS)
+    concurrently, from one read-only DB snapshot and one set of quotes.
+    The parameters have the same meaning as on the per-section endpoints;
+    `limit` is the page size of the transactions/investments sections.
+    """
+    requested = list(dict.fromkeys(s.strip() for s in sections.split(",") if s.strip())) if sections else DASHBOARD_SECTIONS
+    unknown = [s for s in requested if s not in DASHBOARD_SECTIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown sections: {', '.join(unknown)}")
+    if "monthly_finances" in requested:
+        # Rejected here rather than by the section, while no query is running yet
+        check_period_params(months, granularity)
+
+    if "networth_history" in requested:
+        # Writes to the snapshot tables, so it runs before the read-only transaction
+        await ensure_snapshots_fresh(db, user_id)
+
+    quotes = QuoteSnapshot()
+    shared = SerializedConnection(db)
+    builders = {
+        "networth": lambda: cached_result(
+            shared, user_id, "networth", {}, lambda: compute_networth(shared, user_id, quotes), prices=True
+        ),
+        "finance_composition": lambda: cached_result(
+            shared, user_id, "finance_composition", {}, lambda: compute_finance_composition(shared, user_id, quotes), prices=True
+        ),
+        "expenses_by_category": lambda: get_expenses_by_category(user_id=user_id, db=shared),
+        "monthly_finances": lambda: get_monthly_finances(months=months, granularity=granularity, user_id=user_id, db=shared),
+        "networth_history": lambda: networth_history_points(shared, user_id, range_days),
+        "transactions": lambda: get_transactions(limit=limit, user_id=user_id, db=shared),
+        "investments": lambda: get_investments(limit=limit, user_id=user_id, db=shared),
+    }
+    async with db.transaction(isolation="repeatable_read", readonly=True):
+        # Every section completes before the transaction ends, even when one fails: the
+        # connection cannot roll back while a sibling query is still in progress
+        results = await asyncio.gather(*(builders[name]() for name in requested), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+    return dict(zip(requested, results))
+
+
 
 
 ############################
@@ -322,17 +559,22 @@ async def create_transaction(
         RETURNING id;
         """
 
-        result = await db.fetchrow(
-            query,
-            user_id,
-            transaction.type,
-            transaction.amount,
-            transaction.description,
-            transaction.category_id,
-            transaction_date,
-        )
+        async with db.transaction():
+            await lock_user_data(db, user_id)
+            result = await db.fetchrow(
+                query,
+                user_id,
+                transaction.type,
+                transaction.amount,
+                transaction.description,
+                transaction.category_id,
+                transaction_date,
+            )
+            await sync_cashflow(db, user_id, [transaction_date])
+            await bump_versions(db, user_id, ["transactions"])
 
         if result:
+            await mark_snapshots_dirty(db, user_id, transaction_date)
             return {"message": "Transaction added successfully", "id": result["id"]}
         else:
             raise HTTPException(status_code=400, detail="Failed to add transaction")
@@ -342,6 +584,34 @@ async def create_transaction(
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
     
     
+# POST endpoint to import a bank statement (raw CSV, OFX or NDJSON body)
+@app.post("/transactions/import")
+async def import_transactions_file(
+    request: Request,
+    format: str = "csv",
+    user_id: str = Depends(verify_token),
+    db: asyncpg.Connection = Depends(get_db),
+):
+    try:
+        result = await import_transactions(db, user_id, request.stream(), format.lower())
+    except asyncpg.PostgresError as e:
+        logger.error(f"❌ Database error during transaction import: {e}")
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+    if result["first_date"] is not None:
+        await mark_snapshots_dirty(db, user_id, result["first_date"])
+    logger.info(
+        f"✅ Imported {result['imported']} transactions "
+        f"({len(result['duplicates'])} duplicates, {len(result['errors'])} errors)"
+    )
+    return {
+        "message": "Import completed",
+        "imported": result["imported"],
+        "duplicates": result["duplicates"],
+        "errors": result["errors"],
+    }
+
+
 # POST endpoint to create investments
 @app.post("/investments", status_code=status.HTTP_201_CREATED)
 async def create_investment_new(
@@ -350,12 +620,14 @@ async def create_investment_new(
     db: asyncpg.Connection = Depends(get_db),
 ):
     # 1. Validazione del ticker in base al tipo di asset
-    if investment.asset_type.lower() in ["stock", "etf"]:
-        valid = validate_ticker_yfinance(investment.ticker)
-    elif investment.asset_type.lower() == "crypto":
-        valid = validate_ticker_coingecko(investment.ticker)
-    else:
+    if investment.asset_type.lower() not in ["stock", "etf", "crypto"]:
         raise HTTPException(status_code=400, detail=f"Asset type {investment.asset_type} non supportato")
+    valid = await validate_ticker(investment.asset_type, investment.ticker)
+    if valid is None:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Impossibile verificare {investment.ticker} in questo momento, riprovare tra poco"
+        )
     if not valid:
         raise HTTPException(
             status_code=400,
@@ -369,6 +641,7 @@ async def create_investment_new(
         raise HTTPException(status_code=400, detail="Formato data non valido")
     
     async with db.transaction():
+        await lock_user_data(db, user_id)
         # 4. Inserisci l'investimento
         insert_query = """
         INSERT INTO investments (
@@ -413,6 +686,7 @@ async def create_investment_new(
                 RETURNING id;
                 """
                 cat_id = await db.fetchval(cat_insert, user_id)
+                await bump_versions(db, user_id, ["categories"])
             # b) Crea la transazione e ottieni il transaction_id
             trx_query = """
             INSERT INTO transactions 
@@ -430,10 +704,60 @@ async def create_investment_new(
             WHERE id = $2;
             """
             await db.execute(update_investment_query, trx_id, new_id)
+            await sync_cashflow(db, user_id, [op_date])
+            await bump_versions(db, user_id, ["transactions"])
+
+        await sync_holdings(db, user_id, [(investment.asset_type, investment.ticker)])
+        await bump_versions(db, user_id, ["investments"])
+        await mark_snapshots_dirty(db, user_id, op_date)
     
     return {"message": "Investment added successfully", "id": new_id}
 
 
+# POST endpoint to create many investments at once (broker exports, DCA plans)
+@app.post("/investments/bulk", status_code=status.HTTP_201_CREATED)
+async def create_investments_bulk(
+    investments: List[Investment],
+    user_id: str = Depends(verify_token),
+    db: asyncpg.Connection = Depends(get_db),
+):
+    try:
+        result = await import_investments(
+            db, user_id, [inv.model_dump() for inv in investments], validate_ticker
+        )
+    except asyncpg.PostgresError as e:
+        logger.error(f"❌ Database error during bulk investment insert: {e}")
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+    if result["first_date"] is not None:
+        await mark_snapshots_dirty(db, user_id, result["first_date"])
+    return {
+        "message": f"{len(result['created'])} investments added successfully",
+        "created": result["created"],
+        "errors": result["errors"],
+    }
+
+
+# POST endpoint to apply several create/update/delete operations atomically
+@app.post("/batch")
+async def batch_operations(
+    batch: BatchRequest,
+    user_id: str = Depends(verify_token),
+    db: asyncpg.Connection = Depends(get_db),
+):
+    try:
+        results, first_date = await run_batch(
+            db, user_id, [op.model_dump() for op in batch.operations], validate_ticker
+        )
+    except asyncpg.PostgresError as e:
+        logger.error(f"❌ Database error during batch: {e}")
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+    if first_date is not None:
+        await mark_snapshots_dirty(db, user_id, first_date)
+    return {"message": "Batch completed successfully", "results": results}
+
+
 # POST endpoint for user registration
 @app.post("/register", status_code=status.HTTP_201_CREATED)
 async def register_user(user: UserCreate, db: asyncpg.Connection = Depends(get_db)):
@@ -458,26 +782,32 @@ async def complete_onboarding(
     if data.initial_balance < 0:
         raise HTTPException(status_code=400, detail="Initial balance must be positive or 0")
     
-    # Insert into accounts table
-    await db.execute(
-        "INSERT INTO accounts (user_id, initial_balance) VALUES ($1, $2)",
-        user_id, data.initial_balance
-    )
-    
-    # Insert expense categories
-    for cat in data.expense_categories:
-        await db.execute(
-            "INSERT INTO categories (user_id, type, name, icon) VALUES ($1, 'expense', $2, $3)",
-            user_id, cat.name, cat.icon
-        )
-    
-    # Insert income categories
-    for cat in data.income_categories:
+    async with db.transaction():
+        await lock_user_data(db, user_id)
+        # Insert into accounts table
         await db.execute(
-            "INSERT INTO categories (user_id, type, name, icon) VALUES ($1, 'income', $2, $3)",
-            user_id, cat.name, cat.icon
+            "INSERT INTO accounts (user_id, initial_balance) VALUES ($1, $2)",
+            user_id, data.initial_balance
         )
-    
+
+        # Insert expense categories
+        for cat in data.expense_categories:
+            await db.execute(
+                "INSERT INTO categories (user_id, type, name, icon) VALUES ($1, 'expense', $2, $3)",
+                user_id, cat.name, cat.icon
+            )
+
+        # Insert income categories
+        for cat in data.income_categories:
+            await db.execute(
+                "INSERT INTO categories (user_id, type, name, icon) VALUES ($1, 'income', $2, $3)",
+                user_id, cat.name, cat.icon
+            )
+
+        await bump_versions(db, user_id, ["account", "categories"])
+        # The initial balance shifts the whole net worth history
+        await invalidate_snapshots(db, user_id)
+
     return {"message": "Onboarding completed successfully"}
 
 
@@ -501,6 +831,7 @@ async def create_category(
         category.icon
     )
     if result:
+        await bump_versions(db, user_id, ["categories"])
         return {
             "id": result["id"],
             "type": result["type"],
@@ -533,27 +864,34 @@ async def update_transaction(
             if updated_transaction.transaction_date else date.today()
         )
         update_query = """
-        UPDATE transactions
+        UPDATE transactions t
         SET type = $1,
             amount = $2,
             description = $3,
             category_id = $4,
             transaction_date = $5
-        WHERE id = $6 AND user_id = $7
-        RETURNING id;
+        FROM (SELECT transaction_date FROM transactions WHERE id = $6 AND user_id = $7) old
+        WHERE t.id = $6 AND t.user_id = $7
+        RETURNING t.id, old.transaction_date AS old_date;
         """
-        result = await db.fetchval(
-            update_query,
-            updated_transaction.type,
-            updated_transaction.amount,
-            updated_transaction.description,
-            updated_transaction.category_id,
-            transaction_date,
-            transaction_id,
-            user_id
-        )
-        if not result:
-            raise HTTPException(status_code=404, detail="Transaction not found or not authorized")
+        async with db.transaction():
+            await lock_user_data(db, user_id)
+            row = await db.fetchrow(
+                update_query,
+                updated_transaction.type,
+                updated_transaction.amount,
+                updated_transaction.description,
+                updated_transaction.category_id,
+                transaction_date,
+                transaction_id,
+                user_id
+            )
+            if not row:
+                raise HTTPException(status_code=404, detail="Transaction not found or not authorized")
+            await sync_cashflow(db, user_id, [row["old_date"], transaction_date])
+            await bump_versions(db, user_id, ["transactions"])
+        result = row["id"]
+        await mark_snapshots_dirty(db, user_id, min(row["old_date"], transaction_date))
         return {"message": "Transaction updated successfully", "id": result}
     except asyncpg.PostgresError as e:
         logger.error(f"❌ Database error during transaction update: {e}")
@@ -571,7 +909,7 @@ async def update_investment(
     try:
         op_date = datetime.strptime(updated_investment.date_of_operation, "%Y-%m-%d").date()
         update_query = """
-        UPDATE investments
+        UPDATE investments i
         SET type_of_operation = $1,
             asset_type = $2,
             ticker = $3,
@@ -580,41 +918,54 @@ async def update_investment(
             total_value = $6,
             date_of_operation = $7,
             exchange = $8
-        WHERE id = $9 AND user_id = $10
-        RETURNING id;
+        FROM (SELECT date_of_operation, asset_type, ticker FROM investments WHERE id = $9 AND user_id = $10) old
+        WHERE i.id = $9 AND i.user_id = $10
+        RETURNING i.id, old.date_of_operation AS old_date, old.asset_type AS old_asset_type, old.ticker AS old_ticker;
         """ 
-        # Esegui l'aggiornamento dell'investimento
-        result = await db.fetchval(
-            update_query,
-            updated_investment.type_of_operation,
-            updated_investment.asset_type,
-            updated_investment.ticker,
-            updated_investment.full_name,
-            updated_investment.quantity,
-            updated_investment.total_value,
-            op_date,
-            updated_investment.exchange,
-            investment_id,
-            user_id
-        )
-        if not result:
-            raise HTTPException(status_code=404, detail="Investment not found or not authorized")
-        
-        # Se l'operazione è "buy", aggiorna la transazione corrispondente
+        async with db.transaction():
+            await lock_user_data(db, user_id)
+            # Esegui l'aggiornamento dell'investimento
+            row = await db.fetchrow(
+                update_query,
+                updated_investment.type_of_operation,
+                updated_investment.asset_type,
+                updated_investment.ticker,
+                updated_investment.full_name,
+                updated_investment.quantity,
+                updated_investment.total_value,
+                op_date,
+                updated_investment.exchange,
+                investment_id,
+                user_id
+            )
+            if not row:
+                raise HTTPException(status_code=404, detail="Investment not found or not authorized")
+            result = row["id"]
+            await bump_versions(db, user_id, ["investments"])
+            await sync_holdings(db, user_id, [
+                (row["old_asset_type"], row["old_ticker"]),
+                (updated_investment.asset_type, updated_investment.ticker),
+            ])
+            await mark_snapshots_dirty(db, user_id, min(row["old_date"], op_date))
+
+            # Se l'operazione è "buy", aggiorna la transazione corrispondente
+            if updated_investment.type_of_operation.lower() == "buy":
+                trx_update_query = """
+                UPDATE transactions
+                SET amount = $1,
+                    description = $2,
+                    transaction_date = $3
+                WHERE id = $4 AND user_id = $5;
+                """
+                description = f"buy {updated_investment.full_name}"
+                # Recupera il transaction_id associato all'investimento
+                trx_id = await db.fetchval("SELECT transaction_id FROM investments WHERE id = $1", investment_id)
+                if trx_id:
+                    await db.execute(trx_update_query, updated_investment.total_value, description, op_date, trx_id, user_id)
+                    await sync_cashflow(db, user_id, [row["old_date"], op_date])
+                    await bump_versions(db, user_id, ["transactions"])
+
         if updated_investment.type_of_operation.lower() == "buy":
-            trx_update_query = """
-            UPDATE transactions
-            SET amount = $1,
-                description = $2,
-                transaction_date = $3
-            WHERE id = $4 AND user_id = $5;
-            """
-            description = f"buy {updated_investment.full_name}"
-            # Recupera il transaction_id associato all'investimento
-            trx_id = await db.fetchval("SELECT transaction_id FROM investments WHERE id = $1", investment_id)
-            if trx_id:
-                await db.execute(trx_update_query, updated_investment.total_value, description, op_date, trx_id, user_id)
-            
             return {"message": "Investment updated successfully", "id": result}
         
     except asyncpg.PostgresError as e:
@@ -640,11 +991,16 @@ async def delete_transaction(
         delete_query = """
         DELETE FROM transactions
         WHERE id = $1 AND user_id = $2
-        RETURNING id;
+        RETURNING transaction_date;
         """
-        deleted_id = await db.fetchval(delete_query, transaction_id, user_id)
-        if not deleted_id:
-            raise HTTPException(status_code=404, detail="Transaction not found or not authorized")
+        async with db.transaction():
+            await lock_user_data(db, user_id)
+            deleted_date = await db.fetchval(delete_query, transaction_id, user_id)
+            if not deleted_date:
+                raise HTTPException(status_code=404, detail="Transaction not found or not authorized")
+            await sync_cashflow(db, user_id, [deleted_date])
+            await bump_versions(db, user_id, ["transactions"])
+        await mark_snapshots_dirty(db, user_id, deleted_date)
         return {"message": "Transaction deleted successfully"}
     except asyncpg.PostgresError as e:
         logger.error(f"❌ Database error during transaction delete: {e}")
@@ -659,20 +1015,29 @@ async def delete_investment(
     db: asyncpg.Connection = Depends(get_db)
 ):
     try:
-        # Prima elimina la transazione corrispondente
-        trx_id = await db.fetchval("SELECT transaction_id FROM investments WHERE id = $1", investment_id)
-        if trx_id:
-            await db.execute("DELETE FROM transactions WHERE id = $1 AND user_id = $2", trx_id, user_id)
-        
-        # Poi elimina l'investimento
-        delete_query = """
-        DELETE FROM investments
-        WHERE id = $1 AND user_id = $2
-        RETURNING id;
-        """
-        deleted_id = await db.fetchval(delete_query, investment_id, user_id)
-        if not deleted_id:
-            raise HTTPException(status_code=404, detail="Investment not found or not authorized")
+        async with db.transaction():
+            await lock_user_data(db, user_id)
+            # Prima elimina la transazione corrispondente
+            trx_id = await db.fetchval("SELECT transaction_id FROM investments WHERE id = $1", investment_id)
+            if trx_id:
+                trx_date = await db.fetchval(
+                    "DELETE FROM transactions WHERE id = $1 AND user_id = $2 RETURNING transaction_date", trx_id, user_id
+                )
+                await sync_cashflow(db, user_id, [trx_date])
+                await bump_versions(db, user_id, ["transactions"])
+
+            # Poi elimina l'investimento
+            delete_query = """
+            DELETE FROM investments
+            WHERE id = $1 AND user_id = $2
+            RETURNING date_of_operation, asset_type, ticker;
+            """
+            deleted = await db.fetchrow(delete_query, investment_id, user_id)
+            if not deleted:
+                raise HTTPException(status_code=404, detail="Investment not found or not authorized")
+            await sync_holdings(db, user_id, [(deleted["asset_type"], deleted["ticker"])])
+            await bump_versions(db, user_id, ["investments"])
+            await mark_snapshots_dirty(db, user_id, deleted["date_of_operation"])
         return {"message": "Investment deleted successfully"}
     except asyncpg.PostgresError as e:
         logger.error(f"❌ Database error during investment delete: {e}")
@@ -685,7 +1050,12 @@ async def delete_all_transactions(
     user_id: str = Depends(verify_token),
     db: asyncpg.Connection = Depends(get_db)
 ):
-    await db.execute("DELETE FROM transactions WHERE user_id = $1", user_id)
+    async with db.transaction():
+        await lock_user_data(db, user_id)
+        await db.execute("DELETE FROM transactions WHERE user_id = $1", user_id)
+        await clear_cashflow(db, user_id)
+        await bump_versions(db, user_id, ["transactions"])
+    await invalidate_snapshots(db, user_id)
     return {"message": "All transactions deleted successfully"}
 
 
@@ -695,7 +1065,12 @@ async def delete_all_investments(
     user_id: str = Depends(verify_token),
     db: asyncpg.Connection = Depends(get_db)
 ):
-    await db.execute("DELETE FROM investments WHERE user_id = $1", user_id)
+    async with db.transaction():
+        await lock_user_data(db, user_id)
+        await db.execute("DELETE FROM investments WHERE user_id = $1", user_id)
+        await clear_holdings(db, user_id)
+        await bump_versions(db, user_id, ["investments"])
+    await invalidate_snapshots(db, user_id)
     return {"message": "All investments deleted successfully"}
 
 
@@ -705,8 +1080,14 @@ async def delete_account_data(
     user_id: str = Depends(verify_token),
     db: asyncpg.Connection = Depends(get_db)
 ):
-    await db.execute("DELETE FROM transactions WHERE user_id = $1", user_id)
-    await db.execute("DELETE FROM investments WHERE user_id = $1", user_id)
+    async with db.transaction():
+        await lock_user_data(db, user_id)
+        await db.execute("DELETE FROM transactions WHERE user_id = $1", user_id)
+        await db.execute("DELETE FROM investments WHERE user_id = $1", user_id)
+        await clear_cashflow(db, user_id)
+        await clear_holdings(db, user_id)
+        await bump_versions(db, user_id, ["transactions", "investments"])
+    await invalidate_snapshots(db, user_id)
     return {"message": "Account data deleted successfully"}
 
 
@@ -716,8 +1097,14 @@ async def delete_account(
     user_id: str = Depends(verify_token),
     db: asyncpg.Connection = Depends(get_db)
 ):
-    await db.execute("DELETE FROM transactions WHERE user_id = $1", user_id)
-    await db.execute("DELETE FROM investments WHERE user_id = $1", user_id)
+    async with db.transaction():
+        await lock_user_data(db, user_id)
+        await db.execute("DELETE FROM transactions WHERE user_id = $1", user_id)
+        await db.execute("DELETE FROM investments WHERE user_id = $1", user_id)
+        await clear_cashflow(db, user_id)
+        await clear_holdings(db, user_id)
+        await bump_versions(db, user_id, DATA_SCOPES)
+    await invalidate_snapshots(db, user_id)
     deleted_id = await db.fetchval("DELETE FROM users WHERE id = $1 RETURNING id", user_id)
     if not deleted_id:
         raise HTTPException(status_code=404, detail="User not found")
@@ -730,237 +1117,81 @@ async def delete_account(
 ### API Endpoints - PLOTS ###
 #############################
 
-# Endpoint to get net worth history
-@app.get("/networth-history")
-async def get_networth_history(
-    range_days: int = 90,
-    user_id: str = Depends(verify_token),
-    db = Depends(get_db)
+# Net worth history points from the (already refreshed) daily snapshots
+async def networth_history_points(
+    db,
+    user_id: str,
+    range_days: int,
+    resolution: str = "day",
+    max_points: Optional[int] = None,
+    columnar: bool = False,
 ):
     today = date.today()
+    rows = await get_snapshots(db, user_id, today)
+    if not rows:
+        return {"dates": [], "networth": [], "investments": []} if columnar else []
 
-    # Get historical EUR/USD exchange rates
-    def get_eur_rates(start_date, end_date):
-        try:
-            eurusd = yf.Ticker("EURUSD=X").history(
-                start=start_date.strftime("%Y-%m-%d"),
-                end=end_date.strftime("%Y-%m-%d")
-            )
-            return {idx.date(): 1 / row["Close"] for idx, row in eurusd.iterrows()}
-        except Exception as e:
-            logger.error(f"Error fetching EUR rates: {e}")
-            return {}
-
-    # Original date calculation remains unchanged
-    earliest_date_query = """
-        SELECT MIN(t1) AS earliest
-        FROM (
-            SELECT MIN(transaction_date) AS t1 FROM transactions WHERE user_id = $1
-            UNION
-            SELECT MIN(date_of_operation) AS t1 FROM investments WHERE user_id = $1
-        ) as sub
-    """
-    earliest_date = await db.fetchval(earliest_date_query, user_id)
-    if earliest_date is None:
-        return []
-
+    # The series always starts at the first record, or earlier (zero-valued) if range_days asks so
+    earliest_date = rows[0]["snapshot_date"]
     calc_start = today - timedelta(days=range_days)
-    start_date = min(earliest_date, calc_start)
-
-    # Get EUR conversion rates for the entire period
-    eur_rates = get_eur_rates(start_date, today)
-
-    # Original transaction loading remains unchanged
-    query_init_balance = """SELECT COALESCE((SELECT initial_balance FROM accounts WHERE user_id = $1 LIMIT 1), 0)"""
-    initial_balance = float(await db.fetchval(query_init_balance, user_id) or 0)
-
-    query_transactions = """
-        SELECT transaction_date, type, amount
-        FROM transactions
-        WHERE user_id = $1
-          AND transaction_date <= $2
-        ORDER BY transaction_date
-    """
-    rows_trx = await db.fetch(query_transactions, user_id, today)
-    
-    daily_income = defaultdict(float)
-    daily_expense = defaultdict(float)
-    for r in rows_trx:
-        d = r["transaction_date"]
-        amt = float(r["amount"])
-        if r["type"] == "income":
-            daily_income[d] += amt
-        elif r["type"] == "expense":
-            daily_expense[d] += amt
-
-    # Original investment loading remains unchanged
-    query_invest = """
-        SELECT date_of_operation, type_of_operation, asset_type, ticker, quantity
-        FROM investments
-        WHERE user_id = $1
-          AND date_of_operation <= $2
-        ORDER BY date_of_operation
-    """
-    rows_inv = await db.fetch(query_invest, user_id, today)
-
-    tickers_stock_etf = set()
-    tickers_crypto = set()
-    daily_invest_ops = defaultdict(list)
-
-    for r in rows_inv:
-        d = r["date_of_operation"]
-        asset_type = r["asset_type"].lower()
-        tck = r["ticker"]
-        op_type = r["type_of_operation"].lower()
-        qty = float(r["quantity"] or 0)
-
-        daily_invest_ops[d].append({
-            "asset_type": asset_type,
-            "ticker": tck,
-            "op_type": op_type,
-            "qty": qty
-        })
-
-        if asset_type in ["stock", "etf"]:
-            tickers_stock_etf.add(tck)
-        elif asset_type == "crypto":
-            tickers_crypto.add(tck)
-
-    # Modified price fetching section
-    prices_yf = {}
-    if tickers_stock_etf:
-        start_str = start_date.strftime("%Y-%m-%d")
-        end_str = (today + timedelta(days=1)).strftime("%Y-%m-%d")
-        
-        for tck in tickers_stock_etf:
-            df = yf.Ticker(tck).history(start=start_str, end=end_str)
-            daily_dict = {}
-            for idx, row in df.iterrows():
-                day_only = idx.date()
-                usd_price = float(row["Close"])
-                
-                # Find appropriate EUR rate
-                eur_rate = 0.85  # Fallback rate
-                for i in range(7):  # Check up to 7 days back
-                    check_date = day_only - timedelta(days=i)
-                    if check_date in eur_rates:
-                        eur_rate = eur_rates[check_date]
-                        break
-                
-                daily_dict[day_only] = usd_price * eur_rate
-            prices_yf[tck] = daily_dict
-
-    # Modified crypto price fetching (direct EUR)
-    cg = CoinGeckoAPI()
-    prices_cg = {}
-    for tck in tickers_crypto:
-        search = cg.search(query=tck)
-        if not search.get("coins"):
-            continue
-        coin_id = search["coins"][0]["id"]
-        
-        start_ts = int(start_date.strftime("%s"))
-        end_ts = int((today + timedelta(days=1)).strftime("%s"))
-        
-        market_data = cg.get_coin_market_chart_range(
-            id=coin_id,
-            vs_currency="eur",
-            from_timestamp=start_ts,
-            to_timestamp=end_ts
-        )
-        
-        daily_dict = {}
-        for ts_price in market_data.get("prices", []):
-            ts = ts_price[0] / 1000.0
-            p = float(ts_price[1])
-            dt = date.fromtimestamp(ts)
-            daily_dict[dt] = p
-        prices_cg[tck] = daily_dict
-
-    # Original calculation logic remains unchanged
-    current_balance = 0.0
-    positions = defaultdict(float)
-    results = []
-    day_iter = start_date
-
-    while day_iter <= today:
-        if day_iter < earliest_date:
-            networth = 0.0
-            invests_val = 0.0
-        else:
-            if day_iter == earliest_date:
-                current_balance += float(initial_balance)
-
-            inc = daily_income.get(day_iter, 0.0)
-            exp = daily_expense.get(day_iter, 0.0)
-            current_balance += inc
-            current_balance -= exp
-
-            if day_iter in daily_invest_ops:
-                for op in daily_invest_ops[day_iter]:
-                    tck = op["ticker"]
-                    qty = op["qty"]
-                    if op["op_type"] == "buy":
-                        positions[tck] += qty
-                    elif op["op_type"] == "sell":
-                        positions[tck] -= qty
-                        if positions[tck] < 0:
-                            positions[tck] = 0
-
-            invests_val = 0.0
-            for tck, qty in positions.items():
-                if qty <= 0:
-                    continue
-                price = 0.0
-                if tck in tickers_stock_etf:
-                    dtemp = day_iter
-                    for _ in range(7):
-                        if dtemp in prices_yf.get(tck, {}):
-                            price = prices_yf[tck][dtemp]
-                            break
-                        dtemp = dtemp - timedelta(days=1)
-                elif tck in tickers_crypto:
-                    dtemp = day_iter
-                    for _ in range(7):
-                        if dtemp in prices_cg.get(tck, {}):
-                            price = prices_cg[tck][dtemp]
-                            break
-                        dtemp = dtemp - timedelta(days=1)
-                invests_val += qty * price
-
-            networth = current_balance + invests_val
-
-        results.append({
-            "date": day_iter.isoformat(),
-            "networth": round(networth, 2),
-            "investments": round(invests_val, 2),
-        })
-        day_iter += timedelta(days=1)
-
-    return results
+    padding = max((earliest_date - calc_start).days, 0)
+    days = np.concatenate([
+        np.datetime64(calc_start, "D") + np.arange(padding),
+        np.array([r["snapshot_date"] for r in rows], dtype="datetime64[D]"),
+    ])
+    networth = np.concatenate([np.zeros(padding), np.fromiter((r["net_worth"] for r in rows), dtype=float, count=len(rows))])
+    investments = np.concatenate([np.zeros(padding), np.fromiter((r["investment_value"] for r in rows), dtype=float, count=len(rows))])
+
+    # Weekly/monthly points are the value at the end of each period, then LTTB keeps at most max_points
+    keep = period_ends(days, resolution)
+    if max_points is not None and len(keep) > max_points:
+        keep = keep[lttb(days[keep].astype(np.int64).astype(float), networth[keep], max_points)]
+
+    dates = np.datetime_as_string(days[keep]).tolist()
+    networth = np.round(networth[keep], 2).tolist()
+    investments = np.round(investments[keep], 2).tolist()
+    if columnar:
+        return {"dates": dates, "networth": networth, "investments": investments}
+    return [
+        {"date": d, "networth": n, "investments": i}
+        for d, n, i in zip(dates, networth, investments)
+    ]
 
 
-# Endpoint to get finance composition
-@app.get("/finance-composition")
-async def finance_composition(
+# Endpoint to get net worth history
+@app.get("/networth-history")
+async def get_networth_history(
+    range_days: int = 90,
+    range_: Optional[int] = Query(None, alias="range"),
+    format: str = "rows",
+    resolution: str = "day",
+    max_points: Optional[int] = None,
     user_id: str = Depends(verify_token),
-    db: asyncpg.Connection = Depends(get_db)
+    db = Depends(get_db)
 ):
     """
-    Returns portfolio composition in Euros
+    Daily net worth and investment value. `range` (what the chart sends) is the same as
+    `range_days`. format=columnar returns {"dates", "networth", "investments"} arrays instead
+    of one object per day; resolution=week|month keeps the last value of each period and
+    max_points (at least 3) downsamples with LTTB.
     """
-    # Get current USD to EUR exchange rate
-    def get_usd_to_eur():
-        try:
-            eur_usd = yf.Ticker("EURUSD=X").history(period="1d")
-            if not eur_usd.empty:
-                rate = 1 / eur_usd["Close"].iloc[-1]
-                return round(rate, 4)
-            return 0.85  # Fallback rate
-        except Exception:
-            return 0.85
+    if format not in ["rows", "columnar"]:
+        raise HTTPException(status_code=400, detail="format must be rows or columnar")
+    if resolution not in RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"resolution must be one of: {', '.join(RESOLUTIONS)}")
+    if max_points is not None and max_points < 3:
+        raise HTTPException(status_code=400, detail="max_points must be at least 3")
+
+    # Bring the materialized daily snapshots up to date (only dirty/new days are recomputed)
+    await ensure_snapshots_fresh(db, user_id)
+    return await networth_history_points(
+        db, user_id, range_ if range_ is not None else range_days,
+        resolution, max_points, format == "columnar",
+    )
+
 
-    usd_to_eur = get_usd_to_eur()
+# Portfolio composition in Euros, shared by GET /finance-composition and GET /dashboard
+async def compute_finance_composition(db, user_id: str, quotes: QuoteSnapshot):
 
     # 1. Get initial balance (assuming stored in EUR)
     initial_balance = float(await db.fetchval(
@@ -968,89 +1199,43 @@ async def finance_composition(
         user_id
     ))
 
-    # 2. Calculate available money (EUR)
-    total_income = float(await db.fetchval(
-        "SELECT COALESCE(SUM(amount), 0) FROM transactions WHERE user_id = $1 AND type = 'income'",
-        user_id
-    ))
-    
-    total_expenses = float(await db.fetchval(
-        "SELECT COALESCE(SUM(amount), 0) FROM transactions WHERE user_id = $1 AND type = 'expense'",
-        user_id
-    ))
-    
-    available_money = initial_balance + total_income - total_expenses
+    # 2. Calculate available money (EUR): total income - expenses, read from the daily rollup
+    available_money = initial_balance + await balance_as_of(db, user_id)
 
-    # 3. Get investments and calculate positions
-    investments = await db.fetch(
-        """SELECT asset_type, ticker, type_of_operation, quantity 
-           FROM investments WHERE user_id = $1""",
+    # 3. Get the open positions (maintained on every investment write)
+    holdings = await db.fetch(
+        "SELECT asset_type, ticker, net_quantity FROM holdings WHERE user_id = $1 AND net_quantity > 0",
         user_id
     )
-
-    positions = defaultdict(float)
-    for r in investments:
-        asset_type = r["asset_type"].lower()
-        ticker = r["ticker"].upper()
-        op_type = r["type_of_operation"].lower()
-        qty = float(r["quantity"])
-        
-        key = (asset_type, ticker)
-        positions[key] += qty if op_type == "buy" else -qty
-
-    # Cleanup positions
-    positions = {k: v for k, v in positions.items() if v > 0}
+    positions = {(r["asset_type"], r["ticker"]): float(r["net_quantity"]) for r in holdings}
 
     # 4. Calculate real-time values in EUR
     stocks_total = 0.0
     etf_total = 0.0
     crypto_total = 0.0
-    cg = CoinGeckoAPI()
 
-    # Process Stocks/ETFs (USD to EUR conversion)
-    for (asset_type, ticker), qty in positions.items():
-        if asset_type in ["stock", "etf"]:
-            try:
-                ticker_obj = yf.Ticker(ticker)
-                hist = ticker_obj.history(period="1d")
-                if not hist.empty:
-                    price_usd = hist["Close"].iloc[-1]
-                    price_eur = price_usd * usd_to_eur
-                    value = qty * price_eur
-                    
-                    if asset_type == "stock":
-                        stocks_total += value
-                    else:
-                        etf_total += value
-            except Exception:
-                pass
-
-    # Process Crypto (direct EUR prices)
     crypto_assets = {ticker: qty for (asset_type, ticker), qty in positions.items() 
                     if asset_type == "crypto"}
-    
-    if crypto_assets:
-        crypto_ids = {}
-        for ticker in crypto_assets:
-            try:
-                coin_list = cg.get_coins_list()
-                coin = next((c for c in coin_list if c["symbol"].upper() == ticker), None)
-                if coin:
-                    crypto_ids[ticker] = coin["id"]
-            except:
-                continue
+    stock_prices, crypto_prices = await asyncio.gather(
+        stock_prices_eur(quotes, {
+            ticker: asset_type for (asset_type, ticker) in positions if asset_type in ["stock", "etf"]
+        }),
+        quotes.crypto_prices(crypto_assets),
+    )
 
-        if crypto_ids:
-            try:
-                prices = cg.get_price(
-                    ids=list(crypto_ids.values()),
-                    vs_currencies="eur"
-                )
-                for ticker, coin_id in crypto_ids.items():
-                    if coin_id in prices and "eur" in prices[coin_id]:
-                        crypto_total += crypto_assets[ticker] * prices[coin_id]["eur"]
-            except:
-                pass
+    # Process Stocks/ETFs (EUR prices, converted from each quote currency)
+    for (asset_type, ticker), qty in positions.items():
+        if asset_type in ["stock", "etf"] and ticker in stock_prices:
+            value = qty * stock_prices[ticker]
+            if asset_type == "stock":
+                stocks_total += value
+            else:
+                etf_total += value
+
+    # Process Crypto (direct EUR prices)
+    for ticker, qty in crypto_assets.items():
+        if ticker in crypto_prices:
+            crypto_total += qty * crypto_prices[ticker]
 
     # 5. Calculate totals
     total_net_worth = available_money + stocks_total + etf_total + crypto_total
@@ -1066,6 +1251,21 @@ async def finance_composition(
         "total_net_worth": round(total_net_worth, 2),
         "composition": composition
     }
+
+
+# Endpoint to get finance composition
+@app.get("/finance-composition")
+async def finance_composition(
+    user_id: str = Depends(verify_token),
+    db: asyncpg.Connection = Depends(get_db)
+):
+    """
+    Returns portfolio composition in Euros
+    """
+    return await cached_result(
+        db, user_id, "finance_composition", {},
+        lambda: compute_finance_composition(db, user_id, QuoteSnapshot()), prices=True,
+    )
     
 
 # Endpoint to get expenses by category
@@ -1093,58 +1293,105 @@ async def get_expenses_by_category(
         ORDER BY total DESC
     """
 
-    try:
+    async def compute():
         results = await db.fetch(query, user_id, start_date, end_date)
         return [{"category": r["category"], "amount": float(r["total"])} for r in results]
+
+    try:
+        return await cached_result(db, user_id, "expenses_by_category", {}, compute)
     
     except asyncpg.PostgresError as e:
         logger.error(f"Database error: {e}")
         raise HTTPException(status_code=500, detail="Error retrieving expenses")
     
     
-# Endpoint to get income vs expenses for the last 6 months
+# Parameters of /monthly-finances, also checked up front by /dashboard
+def check_period_params(months: int, granularity: str):
+    if granularity not in ["week", "month", "quarter", "year"]:
+        raise HTTPException(status_code=400, detail="granularity must be week, month, quarter or year")
+    if months < 1 or months > 1200:
+        raise HTTPException(status_code=400, detail="months must be between 1 and 1200")
+
+
+# Endpoint to get income vs expenses per period (by default the last 6 months)
 @app.get("/monthly-finances")
 async def get_monthly_finances(
+    months: int = 6,
+    start: Optional[str] = None,
+    granularity: str = "month",
     user_id: str = Depends(verify_token),
     db: asyncpg.Connection = Depends(get_db)
 ):
-    today = date.today()
-    results = []
+    """
+    Returns income and expenses per week/month/quarter/year, from `start` (YYYY-MM-DD)
+    or from `months` months ago up to today. Periods without transactions are returned as zero.
+    Response format: [{ month: string, period_start: string, income: float, expenses: float }, ...]
+    """
+    check_period_params(months, granularity)
 
-    for i in range(5, -1, -1):
-        month_date = today - relativedelta(months=i)
-        first_day_of_month = month_date.replace(day=1)
-        
-        if i == 0:
-            last_day_of_month = today
-        else:
-            next_month = first_day_of_month + relativedelta(months=1)
-            last_day_of_month = next_month - timedelta(days=1)
+    today = date.today()
+    if start:
+        try:
+            start_date = datetime.strptime(start, "%Y-%m-%d").date()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Formato data non valido")
+    else:
+        start_date = (today - relativedelta(months=months - 1)).replace(day=1)
+
+    # Align the first period to the start of its week/month/quarter/year
+    if granularity == "week":
+        start_date -= timedelta(days=start_date.weekday())
+    elif granularity == "month":
+        start_date = start_date.replace(day=1)
+    elif granularity == "quarter":
+        start_date = start_date.replace(month=(start_date.month - 1) // 3 * 3 + 1, day=1)
+    else:
+        start_date = start_date.replace(month=1, day=1)
 
-        query = """
-            SELECT 
-                SUM(CASE WHEN type = 'income' THEN amount ELSE 0 END) AS income,
-                SUM(CASE WHEN type = 'expense' THEN amount ELSE 0 END) AS expenses
-            FROM transactions
+    query = """
+        WITH buckets AS (
+            SELECT
+                date_trunc($2, day::timestamp) AS period_start,
+                SUM(income) AS income,
+                SUM(expense) AS expenses
+            FROM cashflow_daily
             WHERE user_id = $1
-                AND transaction_date >= $2
-                AND transaction_date <= $3
-        """
-        row = await db.fetchrow(query, user_id, first_day_of_month, last_day_of_month)
-
-        results.append({
-            "month": first_day_of_month.strftime("%B"),
-            "month_num": first_day_of_month.month,  # Added month number
-            "year": first_day_of_month.year,
-            "income": round(float(row["income"] or 0), 2),
-            "expenses": round(float(row["expenses"] or 0), 2)
-        })
-
-    # Sort using the month_num we just added
-    sorted_results = sorted(results, key=lambda x: (x["year"], x["month_num"]))
-    
-    return [{
-        "month": f"{r['month']} {str(r['year'])[2:]}",
-        "income": r["income"],
-        "expenses": r["expenses"]
-    } for r in sorted_results]
\ No newline at end of file
+                AND day >= $3
+                AND day <= $4
+            GROUP BY 1
+        )
+        SELECT
+            p.period_start::date AS period_start,
+            COALESCE(b.income, 0) AS income,
+            COALESCE(b.expenses, 0) AS expenses
+        FROM generate_series(
+            date_trunc($2, $3::timestamp),
+            date_trunc($2, $4::timestamp),
+            $5::text::interval
+        ) AS p(period_start)
+        LEFT JOIN buckets b USING (period_start)
+        ORDER BY p.period_start
+    """
+    step = {"week": "1 week", "month": "1 month", "quarter": "3 months", "year": "1 year"}[granularity]
+
+    def period_label(d: date) -> str:
+        if granularity == "week":
+            return f"W{d.isocalendar()[1]:02d} {str(d.year)[2:]}"
+        if granularity == "quarter":
+            return f"Q{(d.month - 1) // 3 + 1} {str(d.year)[2:]}"
+        if granularity == "year":
+            return str(d.year)
+        return f"{d.strftime('%B')} {str(d.year)[2:]}"
+
+    async def compute():
+        rows = await db.fetch(query, user_id, granularity, start_date, today, step)
+        return [{
+            "month": period_label(r["period_start"]),
+            "period_start": r["period_start"].isoformat(),
+            "income": round(float(r["income"]), 2),
+            "expenses": round(float(r["expenses"]), 2)
+        } for r in rows]
+
+    return await cached_result(
+        db, user_id, "monthly_finances", {"granularity": granularity, "start": start_date}, compute
+    )
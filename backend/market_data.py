@@ -0,0 +1,269 @@
+import logging
+import os
+import threading
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional
+
+import pandas as pd
+import yfinance as yf
+from coin_index import coin_index, resolve_coin_id
+from price_cache import price_cache
+from pycoingecko import CoinGeckoAPI
+from yfinance.exceptions import YFTickerMissingError, YFTzMissingError
+
+logger = logging.getLogger(__name__)
+
+# Max number of symbols sent in a single Yahoo Finance / CoinGecko request
+MARKET_DATA_BATCH_SIZE = int(os.getenv("MARKET_DATA_BATCH_SIZE", "50"))
+
+# Seconds a Yahoo Finance download waits for its turn before failing, rather than holding
+# a worker thread its caller has already given up on
+YF_DOWNLOAD_WAIT = float(os.getenv("YF_DOWNLOAD_WAIT", "60"))
+
+# yf.download collects its results in module-level state (reset by every call), so two
+# downloads running at once overwrite each other's: only one runs at a time in the process
+_download_lock = threading.Lock()
+
+
+
+class ProviderUnavailable(Exception):
+    # The provider could not be reached: the ticker is neither valid nor invalid
+    pass
+
+
+def chunks(items: List[str], size: int = MARKET_DATA_BATCH_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _download_closes(tickers: List[str], **kwargs) -> pd.DataFrame:
+    # One multi-symbol download, returns a (date x ticker) frame of closes
+    if not _download_lock.acquire(timeout=YF_DOWNLOAD_WAIT):
+        raise ProviderUnavailable("Yahoo Finance: too many downloads queued")
+    try:
+        df = yf.download(
+            tickers=tickers,
+            group_by="column",
+            auto_adjust=True,
+            progress=False,
+            threads=True,
+            **kwargs,
+        )
+    finally:
+        _download_lock.release()
+    if df is None or df.empty:
+        return pd.DataFrame(columns=tickers)
+    closes = df["Close"]
+    if isinstance(closes, pd.Series):
+        closes = closes.to_frame(name=tickers[0])
+    return closes
+
+
+# Function to validate a ticker symbol using yfinance
+# (raises ProviderUnavailable when Yahoo Finance cannot tell, e.g. network errors or rate limits)
+def validate_ticker_yfinance(ticker: str) -> bool:
+    if not ticker:
+        return False
+    try:
+        # With raise_errors an unknown symbol raises YFTickerMissingError instead of returning
+        # an empty frame, which is also what yfinance returns when the request itself fails
+        hist = yf.Ticker(ticker).history(period="1d", raise_errors=True)
+    except YFTzMissingError as e:
+        # Also raised when the timezone lookup itself fails (network errors, rate limits),
+        # so it cannot tell an unknown symbol apart from an unreachable provider
+        raise ProviderUnavailable(f"Yahoo Finance: {e}")
+    except YFTickerMissingError:
+        return False
+    except Exception as e:
+        raise ProviderUnavailable(f"Yahoo Finance: {e}")
+    return not hist.empty
+
+
+# Function to validate a ticker symbol using CoinGecko
+# (raises ProviderUnavailable while the coin index cannot be loaded)
+def validate_ticker_coingecko(ticker: str) -> bool:
+    if not ticker:
+        return False
+    # Valid if the symbol, name or id is in the CoinGecko coin index
+    coin_id = resolve_coin_id(ticker)
+    if coin_id is None and not coin_index.loaded:
+        raise ProviderUnavailable("CoinGecko coin index not loaded")
+    return coin_id is not None
+
+
+# Yahoo Finance symbol of the daily EUR/<currency> rate (units of currency per EUR)
+def fx_symbol(currency: str) -> str:
+    return f"EUR{currency}=X"
+
+
+# Current rate from a currency to EUR (cached), None if Yahoo Finance cannot provide it
+def get_fx_rate(currency: str) -> Optional[float]:
+    if currency == "EUR":
+        return 1.0
+
+    def fetch():
+        closes = yf.Ticker(fx_symbol(currency)).history(period="5d")["Close"].dropna()
+        if closes.empty:
+            return None
+        return round(1 / float(closes.iloc[-1]), 6)
+
+    try:
+        return price_cache.get_or_fetch("fx", f"{currency}EUR", fetch)
+    except Exception as e:
+        logger.warning(f"⚠️ FX rate download failed for {currency}: {e}")
+        return None
+
+
+# Currency a Yahoo Finance symbol is quoted in (e.g. "USD", "EUR", "GBp"), None if unknown
+def fetch_quote_currency(ticker: str) -> Optional[str]:
+    try:
+        return yf.Ticker(ticker).fast_info["currency"] or None
+    except Exception as e:
+        logger.warning(f"⚠️ Quote currency lookup failed for {ticker}: {e}")
+        return None
+
+
+def _last_closes(batch: List[str]) -> Dict[str, float]:
+    # Last close of each symbol of one batch, symbols without a quote are left out
+    closes = _download_closes(batch, period="5d")
+    last = closes.ffill().iloc[-1] if not closes.empty else pd.Series(dtype=float)
+    values = {ticker: last.get(ticker) for ticker in batch}
+    return {ticker: float(value) for ticker, value in values.items() if value is not None and not pd.isna(value)}
+
+
+def get_stock_prices(tickers: Dict[str, str]) -> Dict[str, float]:
+    """
+    Last close of each stock/ETF, given as {ticker: asset_type}.
+
+    Cached quotes are reused (stale ones are refreshed in the background); all the others
+    are downloaded together in batches. Tickers without a quote are missing from the result.
+    """
+    prices = {}
+    missing = []
+    stale = {}
+    for ticker, asset_type in tickers.items():
+        cached, revalidate = price_cache.lookup(asset_type, ticker.upper())
+        if cached is None:
+            missing.append(ticker)
+            continue
+        prices[ticker] = cached
+        if revalidate:
+            stale[ticker] = asset_type
+
+    def fetch_stale():
+        closes = {}
+        for batch in chunks(list(stale)):
+            closes.update(_last_closes(batch))
+        return {(stale[ticker], ticker.upper()): value for ticker, value in closes.items()}
+
+    price_cache.revalidate([(asset_type, ticker.upper()) for ticker, asset_type in stale.items()], fetch_stale)
+
+    for batch in chunks(missing):
+        try:
+            closes = _last_closes(batch)
+        except Exception as e:
+            logger.warning(f"⚠️ Price download failed for {batch}: {e}")
+            continue
+        for ticker, value in closes.items():
+            prices[ticker] = value
+            price_cache.set(tickers[ticker], ticker.upper(), value)
+    return prices
+
+
+def _coin_prices_eur(coin_ids: Dict[str, str]) -> Dict[str, float]:
+    # EUR price of each {ticker: coin_id} of one batch, with a single get_price call
+    market_data = CoinGeckoAPI().get_price(ids=list(coin_ids.values()), vs_currencies="eur")
+    values = {ticker: market_data.get(coin_id, {}).get("eur") for ticker, coin_id in coin_ids.items()}
+    return {ticker: float(value) for ticker, value in values.items() if value is not None}
+
+
+def get_crypto_prices_eur(tickers: Iterable[str]) -> Dict[str, float]:
+    """
+    Current EUR price of each coin symbol, fetched with a single get_price call per batch.
+    Cached prices are reused, stale ones are refreshed in the background.
+    """
+    prices = {}
+    coin_ids = {}
+    stale = {}
+    for ticker in tickers:
+        cached, revalidate = price_cache.lookup("crypto", ticker.upper())
+        if cached is not None:
+            prices[ticker] = cached
+            if revalidate:
+                stale[ticker] = resolve_coin_id(ticker)
+            continue
+        coin_id = resolve_coin_id(ticker)
+        if coin_id is not None:
+            coin_ids[ticker] = coin_id
+
+    def fetch_stale():
+        values = {}
+        for batch in chunks([t for t in stale if stale[t] is not None]):
+            values.update(_coin_prices_eur({t: stale[t] for t in batch}))
+        return {("crypto", ticker.upper()): value for ticker, value in values.items()}
+
+    price_cache.revalidate([("crypto", ticker.upper()) for ticker in stale], fetch_stale)
+
+    for batch in chunks(list(coin_ids)):
+        try:
+            values = _coin_prices_eur({t: coin_ids[t] for t in batch})
+        except Exception as e:
+            logger.warning(f"⚠️ Price download failed for {batch}: {e}")
+            continue
+        for ticker, value in values.items():
+            prices[ticker] = value
+            price_cache.set("crypto", ticker.upper(), value)
+    return prices
+
+
+def fetch_stock_histories(tickers: List[str], start_date: date, end_date: date) -> Dict[str, Dict[date, float]]:
+    """
+    Daily closes of several Yahoo Finance symbols between two dates (inclusive),
+    as {ticker: {date: close}}, downloaded in multi-symbol batches.
+    Tickers the provider returned no quote for (whole failed batches, or the all-NaN
+    columns of the symbols that failed within a batch) are left out, so that their range is
+    not recorded as covered.
+    """
+    histories = {}
+    for batch in chunks(list(tickers)):
+        closes = _download_closes(
+            batch,
+            start=start_date.strftime("%Y-%m-%d"),
+            end=(end_date + timedelta(days=1)).strftime("%Y-%m-%d"),
+        )
+        if closes.empty:
+            # Nothing at all came back, treat it as a provider failure for the whole batch
+            continue
+        days = [idx.date() for idx in closes.index]
+        for ticker in batch:
+            if ticker not in closes:
+                continue
+            history = {d: float(p) for d, p in zip(days, closes[ticker].tolist()) if not pd.isna(p)}
+            if history:
+                histories[ticker] = history
+    return histories
+
+
+# Daily EUR prices of a coin between two dates (inclusive), as {date: price}
+def fetch_crypto_history_eur(ticker: str, start_date: date, end_date: date) -> Dict[date, float]:
+    coin_id = resolve_coin_id(ticker)
+    if coin_id is None:
+        return {}
+    market_data = CoinGeckoAPI().get_coin_market_chart_range(
+        id=coin_id,
+        vs_currency="eur",
+        from_timestamp=int(start_date.strftime("%s")),
+        to_timestamp=int((end_date + timedelta(days=1)).strftime("%s"))
+    )
+    daily_dict = {}
+    for ts_price in market_data.get("prices", []):
+        daily_dict[date.fromtimestamp(ts_price[0] / 1000.0)] = float(ts_price[1])
+    return daily_dict
+
+
+def fetch_crypto_histories_eur(tickers: List[str], start_date: date, end_date: date) -> Dict[str, Dict[date, float]]:
+    # CoinGecko has no multi-coin range endpoint, so coins are fetched one by one. As for
+    # stocks, coins without prices (unresolved ids included) are left out, so that their range
+    # is not recorded as covered
+    histories = {ticker: fetch_crypto_history_eur(ticker, start_date, end_date) for ticker in tickers}
+    return {ticker: history for ticker, history in histories.items() if history}
@@ -0,0 +1,105 @@
+from datetime import date, timedelta
+from typing import Iterable, List, Mapping
+
+import numpy as np
+import pandas as pd
+
+# A price is valid for this many days after its quote date (weekends, holidays)
+PRICE_LOOKBACK_DAYS = 6
+
+
+def _price_matrix(prices: Mapping[str, Mapping[date, float]], tickers: List[str], index: pd.DatetimeIndex) -> pd.DataFrame:
+    # (day x ticker) frame with each quote at its own date and NaN elsewhere
+    columns = {}
+    for ticker in tickers:
+        points = prices.get(ticker) or {}
+        columns[ticker] = pd.Series(
+            np.fromiter(points.values(), dtype=float, count=len(points)),
+            index=pd.DatetimeIndex(list(points.keys())),
+        )
+    frame = pd.DataFrame(columns, columns=tickers)
+    return frame.reindex(index)
+
+
+def _positions_matrix(investments: Iterable, tickers: List[str], index: pd.DatetimeIndex) -> pd.DataFrame:
+    """
+    Net quantity held at the end of each day, per ticker.
+
+    Operations are replayed in order and a position never goes below zero after a sell:
+    that running clamp is the cumulative sum minus its running minimum (when negative).
+    """
+    ops = pd.DataFrame.from_records(
+        [(r["date_of_operation"], r["ticker"], (r["type_of_operation"] or "").lower(), r["quantity"])
+         for r in investments],
+        columns=["date", "ticker", "op", "qty"],
+    )
+    if ops.empty:
+        return pd.DataFrame(0.0, index=index, columns=tickers)
+
+    qty = ops["qty"].fillna(0).astype(float)
+    ops["delta"] = np.select([ops["op"] == "buy", ops["op"] == "sell"], [qty, -qty], 0.0)
+    running = ops.groupby("ticker", sort=False)["delta"].cumsum()
+    floor = running.groupby(ops["ticker"], sort=False).cummin().clip(upper=0.0)
+    ops["position"] = running - floor
+    ops["date"] = pd.to_datetime(ops["date"])
+
+    # Operations before the first day only matter through the position they leave
+    ops["date"] = ops["date"].clip(lower=index[0])
+
+    daily = ops.groupby(["date", "ticker"], sort=True)["position"].last().unstack("ticker")
+    return daily.reindex(index=index, columns=tickers).ffill().fillna(0.0)
+
+
+def compute_networth_history(
+    start_date: date,
+    end_date: date,
+    earliest_date: date,
+    initial_balance: float,
+    cashflows: Iterable,
+    investments: Iterable,
+    prices: Mapping[str, Mapping[date, float]],
+) -> pd.DataFrame:
+    """
+    Daily net worth between start_date and end_date (inclusive), as a frame indexed by day
+    with the "networth", "investments" and "cash" columns (EUR).
+
+    - cashflows: daily rollup records with day and balance (cumulative net cashflow, see
+      cashflow.py), sorted by day; the last one before start_date gives the opening balance
+    - investments: records with date_of_operation, type_of_operation, ticker and quantity
+    - prices: EUR quotes per ticker (see fx.FxService.to_eur for the conversion)
+    Days before earliest_date are worth zero. When start_date is after earliest_date, earlier
+    cashflows and operations are folded into the opening balance and positions, and quotes
+    up to PRICE_LOOKBACK_DAYS before start_date are still used for the first days.
+    """
+    index = pd.date_range(start_date, end_date, freq="D")
+    # Wider index used to carry quotes dated just before start_date into the range
+    price_index = pd.date_range(start_date - timedelta(days=PRICE_LOOKBACK_DAYS), end_date, freq="D")
+
+    # Cash: initial balance from the first recorded day, plus cumulative net cashflow
+    flows = pd.DataFrame.from_records(
+        [(r["day"], r["balance"]) for r in cashflows],
+        columns=["date", "balance"],
+    )
+    if flows.empty:
+        cumulative = pd.Series(0.0, index=index)
+    else:
+        flows["date"] = pd.to_datetime(flows["date"]).clip(lower=index[0])
+        cumulative = flows.groupby("date")["balance"].last().astype(float).reindex(index).ffill().fillna(0.0)
+    active = index >= pd.Timestamp(earliest_date)
+    balance = np.where(active, cumulative.to_numpy() + float(initial_balance), 0.0)
+
+    # Prices: every quote carried forward for at most PRICE_LOOKBACK_DAYS
+    tickers = sorted(prices)
+    price_matrix = _price_matrix(prices, tickers, price_index)
+    price_matrix = price_matrix.ffill(limit=PRICE_LOOKBACK_DAYS).fillna(0.0).reindex(index)
+
+    # Positions on tickers without prices (unknown asset types) are worth zero
+    positions = _positions_matrix(investments, tickers, index)
+
+    invest_value = np.einsum("ij,ij->i", positions.to_numpy(), price_matrix.to_numpy())
+    invest_value = np.where(active, invest_value, 0.0)
+
+    return pd.DataFrame(
+        {"networth": balance + invest_value, "investments": invest_value, "cash": balance},
+        index=index,
+    )
@@ -0,0 +1,166 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Freshness window (seconds) for each asset class
+DEFAULT_TTLS = {
+    "stock": float(os.getenv("PRICE_TTL_STOCK", "300")),
+    "etf": float(os.getenv("PRICE_TTL_ETF", "300")),
+    "crypto": float(os.getenv("PRICE_TTL_CRYPTO", "60")),
+    "fx": float(os.getenv("PRICE_TTL_FX", "900")),
+}
+PRICE_CACHE_MAX_ENTRIES = int(os.getenv("PRICE_CACHE_MAX_ENTRIES", "5000"))
+# How long (seconds) past its TTL an entry may still be served while it is refreshed
+PRICE_CACHE_STALE_WINDOW = float(os.getenv("PRICE_CACHE_STALE_WINDOW", "3600"))
+
+
+class PriceCache:
+    """
+    Thread-safe LRU cache for market quotes with a TTL per asset class.
+
+    Entries past their TTL but still inside the stale window are returned as-is
+    while a single background refresh updates them (stale-while-revalidate).
+    """
+
+    def __init__(
+        self,
+        ttls: Dict[str, float],
+        max_entries: int = PRICE_CACHE_MAX_ENTRIES,
+        stale_window: float = PRICE_CACHE_STALE_WINDOW,
+    ):
+        self.ttls = dict(ttls)
+        self.max_entries = max_entries
+        self.stale_window = stale_window
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()  # key -> (value, fetched_at)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="price-refresh")
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.evictions = 0
+
+    def _ttl(self, asset_class: str) -> float:
+        return self.ttls.get(asset_class.lower(), self.ttls.get("stock", 300.0))
+
+    def _store(self, key: tuple, value: Any):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _refresh(self, key: tuple, fetcher: Callable[[], Any]):
+        try:
+            value = fetcher()
+            if value is not None:
+                self._store(key, value)
+        except Exception as e:
+            logger.warning(f"⚠️ Background price refresh failed for {key}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _revalidate_many(self, keys: list, fetcher: Callable[[], Dict[tuple, Any]]):
+        try:
+            for key, value in fetcher().items():
+                if key in keys and value is not None:
+                    self._store(key, value)
+        except Exception as e:
+            logger.warning(f"⚠️ Background price refresh failed for {keys}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.difference_update(keys)
+
+    def set(self, asset_class: str, key: Hashable, value: Any):
+        self._store((asset_class.lower(), key), value)
+
+    def lookup(self, asset_class: str, key: Hashable) -> Tuple[Optional[Any], bool]:
+        """
+        Counted lookup for callers that fetch their misses in batches: returns (value, revalidate).
+        A stale value is returned with revalidate=True when no refresh of it is running yet; the
+        caller then hands it to revalidate(). On a miss the value is None.
+        """
+        full_key = (asset_class.lower(), key)
+        with self._lock:
+            entry = self._entries.get(full_key)
+            if entry is not None:
+                value, fetched_at = entry
+                age = time.monotonic() - fetched_at
+                if age <= self._ttl(asset_class):
+                    self._entries.move_to_end(full_key)
+                    self.hits += 1
+                    return value, False
+                if age <= self._ttl(asset_class) + self.stale_window:
+                    self._entries.move_to_end(full_key)
+                    self.stale_hits += 1
+                    if full_key in self._refreshing:
+                        return value, False
+                    self._refreshing.add(full_key)
+                    return value, True
+            self.misses += 1
+            return None, False
+
+    def revalidate(self, keys: Iterable[Tuple[str, Hashable]], fetcher: Callable[[], Dict[Tuple[str, Hashable], Any]]):
+        # Background refresh of the (asset_class, key) pairs lookup() flagged, with a single
+        # fetch returning {(asset_class, key): value}
+        keys = [(asset_class.lower(), key) for asset_class, key in keys]
+        if keys:
+            fetch = lambda: {(c.lower(), k): v for (c, k), v in fetcher().items()}
+            self._executor.submit(self._revalidate_many, keys, fetch)
+
+    def get_or_fetch(self, asset_class: str, key: Hashable, fetcher: Callable[[], Any]) -> Any:
+        """
+        Returns the cached value for (asset_class, key), calling `fetcher` on a miss.
+        `fetcher` may raise; failures and None results are not cached.
+        """
+        full_key = (asset_class.lower(), key)
+        ttl = self._ttl(asset_class)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(full_key)
+            if entry is not None:
+                value, fetched_at = entry
+                age = now - fetched_at
+                if age <= ttl:
+                    self._entries.move_to_end(full_key)
+                    self.hits += 1
+                    return value
+                if age <= ttl + self.stale_window:
+                    self._entries.move_to_end(full_key)
+                    self.stale_hits += 1
+                    if full_key not in self._refreshing:
+                        self._refreshing.add(full_key)
+                        self._executor.submit(self._refresh, full_key, fetcher)
+                    return value
+            self.misses += 1
+
+        value = fetcher()
+        if value is not None:
+            self._store(full_key, value)
+        return value
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+            }
+
+
+# Shared instance used by every endpoint of the process
+price_cache = PriceCache(DEFAULT_TTLS)
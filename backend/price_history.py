@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import os
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Iterable, List
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+# How often (seconds) the most recent day of a series is re-downloaded
+PRICE_HISTORY_TAIL_TTL = float(os.getenv("PRICE_HISTORY_TAIL_TTL", "3600"))
+
+# async fetcher(tickers, start, end) -> {ticker: {date: close}}
+BatchFetcher = Callable[[List[str], date, date], Awaitable[Dict[str, Dict[date, float]]]]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS price_history (
+    ticker TEXT NOT NULL,
+    source TEXT NOT NULL,
+    price_date DATE NOT NULL,
+    close DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (ticker, source, price_date)
+);
+
+CREATE TABLE IF NOT EXISTS price_history_coverage (
+    ticker TEXT NOT NULL,
+    source TEXT NOT NULL,
+    first_date DATE NOT NULL,
+    last_date DATE NOT NULL,
+    refreshed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (ticker, source)
+);
+"""
+
+
+async def ensure_schema(conn: asyncpg.Connection):
+    await conn.execute(SCHEMA)
+
+
+async def _download(
+    tickers: List[str],
+    source: str,
+    start: date,
+    end: date,
+    fetcher: BatchFetcher,
+) -> Dict[str, Dict[date, float]]:
+    # Download [start, end] for all tickers at once, returns {} on provider errors
+    try:
+        return await fetcher(tickers, start, end)
+    except Exception as e:
+        logger.warning(f"⚠️ History download failed for {tickers} ({source}) {start} → {end}: {e}")
+        return {}
+
+
+async def _store(
+    conn: asyncpg.Connection,
+    histories: Dict[str, Dict[date, float]],
+    source: str,
+    start: date,
+    end: date,
+):
+    # Merge downloaded series into the store; only the tickers in `histories` are marked as
+    # covered, so fetchers leave out those the provider returned no prices for
+    if not histories:
+        return
+    rows = [
+        (ticker.upper(), source, d, float(p))
+        for ticker, prices in histories.items()
+        for d, p in prices.items()
+        if start <= d <= end
+    ]
+    async with conn.transaction():
+        if rows:
+            await conn.executemany(
+                """
+                INSERT INTO price_history (ticker, source, price_date, close)
+                VALUES ($1, $2, $3, $4)
+                ON CONFLICT (ticker, source, price_date) DO UPDATE SET close = EXCLUDED.close
+                """,
+                rows,
+            )
+        await conn.executemany(
+            """
+            INSERT INTO price_history_coverage (ticker, source, first_date, last_date, refreshed_at)
+            VALUES ($1, $2, $3, $4, now())
+            ON CONFLICT (ticker, source) DO UPDATE SET
+                first_date = LEAST(price_history_coverage.first_date, EXCLUDED.first_date),
+                last_date = GREATEST(price_history_coverage.last_date, EXCLUDED.last_date),
+                refreshed_at = now()
+            """,
+            [(ticker.upper(), source, start, min(end, date.today())) for ticker in histories],
+        )
+
+
+async def get_price_histories(
+    conn: asyncpg.Connection,
+    tickers: Iterable[str],
+    source: str,
+    start: date,
+    end: date,
+    fetcher: BatchFetcher,
+) -> Dict[str, Dict[date, float]]:
+    """
+    Returns the daily closes of every ticker between `start` and `end` (inclusive)
+    as {ticker: {date: close}}, with an entry (possibly empty) for each requested ticker.
+
+    Only the dates not yet covered by the store are downloaded with `await fetcher(tickers, start, end)`:
+    the head before the first stored date and the tail after the last one. Tickers missing the
+    same range are downloaded together. The last stored day is re-downloaded at most every
+    PRICE_HISTORY_TAIL_TTL seconds, since it may be a partial close.
+    """
+    tickers = sorted({t.upper() for t in tickers})
+    end = min(end, date.today())
+    if not tickers or start > end:
+        return {t: {} for t in tickers}
+
+    coverage = {
+        r["ticker"]: r
+        for r in await conn.fetch(
+            """
+            SELECT ticker, first_date, last_date, refreshed_at
+            FROM price_history_coverage
+            WHERE source = $1 AND ticker = ANY($2::text[])
+            """,
+            source, tickers,
+        )
+    }
+
+    # Group the tickers by missing date range, so each range costs one batched download
+    gaps = defaultdict(list)
+    now = datetime.now(timezone.utc)
+    for ticker in tickers:
+        cov = coverage.get(ticker)
+        if cov is None:
+            gaps[(start, end)].append(ticker)
+            continue
+        if start < cov["first_date"]:
+            gaps[(start, cov["first_date"] - timedelta(days=1))].append(ticker)
+
+        age = (now - cov["refreshed_at"]).total_seconds()
+        recent_tail = cov["last_date"] >= date.today() - timedelta(days=3)
+        tail_stale = end >= cov["last_date"] and recent_tail and age > PRICE_HISTORY_TAIL_TTL
+        if end > cov["last_date"] or tail_stale:
+            gaps[(cov["last_date"], end)].append(ticker)
+
+    # Downloads run concurrently, writes go through the single connection one after the other
+    ranges = list(gaps)
+    downloads = await asyncio.gather(
+        *(_download(gaps[r], source, r[0], r[1], fetcher) for r in ranges)
+    )
+    for (gap_start, gap_end), histories in zip(ranges, downloads):
+        await _store(conn, histories, source, gap_start, gap_end)
+
+    rows = await conn.fetch(
+        """
+        SELECT ticker, price_date, close
+        FROM price_history
+        WHERE source = $1 AND ticker = ANY($2::text[]) AND price_date BETWEEN $3 AND $4
+        ORDER BY ticker, price_date
+        """,
+        source, tickers, start, end,
+    )
+    histories = {t: {} for t in tickers}
+    for r in rows:
+        histories[r["ticker"]][r["price_date"]] = r["close"]
+    return histories
@@ -0,0 +1,245 @@
+import asyncio
+import functools
+import logging
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import market_data
+
+logger = logging.getLogger(__name__)
+
+# yfinance and pycoingecko are blocking, so every call runs on this bounded pool
+PRICE_PROVIDER_WORKERS = int(os.getenv("PRICE_PROVIDER_WORKERS", "8"))
+# Seconds a single provider call may take before it is abandoned
+PRICE_PROVIDER_TIMEOUT = float(os.getenv("PRICE_PROVIDER_TIMEOUT", "10"))
+PRICE_PROVIDER_HISTORY_TIMEOUT = float(os.getenv("PRICE_PROVIDER_HISTORY_TIMEOUT", "30"))
+# How long (seconds) a ticker validation is trusted: long for known symbols, short for unknown ones
+TICKER_VALID_TTL = float(os.getenv("TICKER_VALID_TTL", str(7 * 24 * 3600)))
+TICKER_INVALID_TTL = float(os.getenv("TICKER_INVALID_TTL", "3600"))
+TICKER_CACHE_MAX_ENTRIES = int(os.getenv("TICKER_CACHE_MAX_ENTRIES", "10000"))
+# Age (seconds) after which the prices published by the scheduler are ignored and quotes fetched live
+PRICE_SNAPSHOT_MAX_AGE = float(os.getenv("PRICE_SNAPSHOT_MAX_AGE", "900"))
+
+_executor = ThreadPoolExecutor(max_workers=PRICE_PROVIDER_WORKERS, thread_name_prefix="price-provider")
+
+
+async def run_sync(func, *args, timeout: float = PRICE_PROVIDER_TIMEOUT, **kwargs):
+    """
+    Runs a blocking provider call on the price thread pool without blocking the event loop.
+
+    Raises asyncio.TimeoutError after `timeout` seconds; the caller stops waiting right away
+    (and on cancellation), while the worker thread finishes in the background.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+    return await asyncio.wait_for(future, timeout)
+
+
+async def _gather_batches(func, batches: List, timeout: float, *args) -> dict:
+    # Runs func(batch, *args) for every batch concurrently and merges the resulting dicts,
+    # batches that fail or time out are logged and skipped
+    results = await asyncio.gather(
+        *(run_sync(func, batch, *args, timeout=timeout) for batch in batches),
+        return_exceptions=True,
+    )
+    merged = {}
+    for batch, result in zip(batches, results):
+        if isinstance(result, BaseException):
+            logger.warning(f"⚠️ {func.__name__} failed for {batch}: {result!r}")
+            continue
+        merged.update(result)
+    return merged
+
+
+async def get_fx_rate(currency: str) -> Optional[float]:
+    # Current rate from `currency` to EUR, None if it cannot be fetched now
+    try:
+        return await run_sync(market_data.get_fx_rate, currency)
+    except asyncio.TimeoutError:
+        logger.warning(f"⚠️ FX rate of {currency} timed out")
+        return None
+
+
+async def get_stock_prices(tickers: Dict[str, str]) -> Dict[str, float]:
+    # {ticker: asset_type} -> {ticker: last close}; the batches' yf.download calls take turns
+    # (see market_data._download_lock)
+    batches = [{t: tickers[t] for t in chunk} for chunk in market_data.chunks(list(tickers))]
+    return await _gather_batches(market_data.get_stock_prices, batches, PRICE_PROVIDER_TIMEOUT)
+
+
+async def get_crypto_prices_eur(tickers: Iterable[str]) -> Dict[str, float]:
+    batches = list(market_data.chunks(list(tickers)))
+    return await _gather_batches(market_data.get_crypto_prices_eur, batches, PRICE_PROVIDER_TIMEOUT)
+
+
+async def fetch_stock_histories(tickers: List[str], start_date: date, end_date: date) -> Dict[str, Dict[date, float]]:
+    batches = list(market_data.chunks(list(tickers)))
+    return await _gather_batches(
+        market_data.fetch_stock_histories, batches, PRICE_PROVIDER_HISTORY_TIMEOUT, start_date, end_date
+    )
+
+
+async def fetch_crypto_histories_eur(tickers: List[str], start_date: date, end_date: date) -> Dict[str, Dict[date, float]]:
+    # One call per coin, all in flight at the same time
+    batches = [[ticker] for ticker in tickers]
+    return await _gather_batches(
+        market_data.fetch_crypto_histories_eur, batches, PRICE_PROVIDER_HISTORY_TIMEOUT, start_date, end_date
+    )
+
+
+class TickerValidator:
+    """
+    Cached ticker validation: known symbols are trusted for TICKER_VALID_TTL, unknown ones for
+    TICKER_INVALID_TTL, while "provider unavailable" is never cached.
+    Concurrent validations of the same symbol share a single provider lookup. The lookups run
+    on the price thread pool, but the entries are only touched from the event loop, so unlike
+    PriceCache this needs no lock.
+    """
+
+    def __init__(
+        self,
+        valid_ttl: float = TICKER_VALID_TTL,
+        invalid_ttl: float = TICKER_INVALID_TTL,
+        max_entries: int = TICKER_CACHE_MAX_ENTRIES,
+    ):
+        self.valid_ttl = valid_ttl
+        self.invalid_ttl = invalid_ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[bool, float]]" = OrderedDict()  # key -> (valid, expires_at)
+        self._inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+
+    async def validate(self, asset_type: str, ticker: str) -> Optional[bool]:
+        if asset_type.lower() in ["stock", "etf"]:
+            provider, validator = "yfinance", market_data.validate_ticker_yfinance
+        elif asset_type.lower() == "crypto":
+            provider, validator = "coingecko", market_data.validate_ticker_coingecko
+        else:
+            return False
+        key = (provider, ticker.strip().upper())
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                return entry[0]
+            del self._entries[key]
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._lookup(key, validator, ticker))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # A caller going away must not cancel the lookup the others are waiting on
+        return await asyncio.shield(task)
+
+    async def _lookup(self, key: Tuple[str, str], validator, ticker: str) -> Optional[bool]:
+        try:
+            valid = await run_sync(validator, ticker)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ Validation of {ticker} timed out")
+            return None
+        except market_data.ProviderUnavailable as e:
+            logger.warning(f"⚠️ Validation of {ticker} not possible: {e}")
+            return None
+        ttl = self.valid_ttl if valid else self.invalid_ttl
+        self._entries[key] = (valid, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return valid
+
+
+ticker_validator = TickerValidator()
+
+
+async def validate_ticker(asset_type: str, ticker: str) -> Optional[bool]:
+    # True/False if the provider of the asset type knows the ticker or not, None if it cannot tell now
+    return await ticker_validator.validate(asset_type, ticker)
+
+
+@dataclass(frozen=True)
+class PublishedPrices:
+    # Quotes of every held ticker, refreshed in the background by price_scheduler
+    version: int = 0
+    published_at: float = 0.0
+    fx: Dict[str, float] = field(default_factory=dict)      # currency -> rate to EUR
+    stock: Dict[str, float] = field(default_factory=dict)   # TICKER -> last close (quote currency)
+    crypto: Dict[str, float] = field(default_factory=dict)  # TICKER -> price (EUR)
+
+    @property
+    def fresh(self) -> bool:
+        return self.version > 0 and time.time() - self.published_at <= PRICE_SNAPSHOT_MAX_AGE
+
+
+_published = PublishedPrices()
+
+
+def published_prices() -> PublishedPrices:
+    return _published
+
+
+def publish_prices(fx: Dict[str, float], stock: Dict[str, float], crypto: Dict[str, float]) -> PublishedPrices:
+    # Swaps in a new snapshot; readers keep the one they already took
+    global _published
+    _published = PublishedPrices(_published.version + 1, time.time(), dict(fx), dict(stock), dict(crypto))
+    return _published
+
+
+class QuoteSnapshot:
+    """
+    One set of quotes shared by every computation of a request (e.g. the dashboard sections).
+
+    Quotes come from the prices published by the background scheduler while they are fresh.
+    The others are fetched live, each at most once: a ticker already requested, even by a
+    call still in flight, is served from that same fetch.
+    """
+
+    def __init__(self):
+        published = published_prices()
+        self.published = published if published.fresh else PublishedPrices()
+        self._fx: Dict[str, asyncio.Future] = {}
+        self._stock: Dict[str, asyncio.Future] = {}
+        self._crypto: Dict[str, asyncio.Future] = {}
+
+    async def fx_rate(self, currency: str) -> Optional[float]:
+        # Current rate from `currency` to EUR, None if unavailable
+        if currency == "EUR":
+            return 1.0
+        if currency in self.published.fx:
+            return self.published.fx[currency]
+        if currency not in self._fx:
+            self._fx[currency] = asyncio.ensure_future(get_fx_rate(currency))
+        return await self._fx[currency]
+
+    @staticmethod
+    async def _prices(
+        futures: Dict[str, asyncio.Future], tickers: List[str], fetch, published: Dict[str, float]
+    ) -> Dict[str, float]:
+        prices = {t: published[t.upper()] for t in tickers if t.upper() in published}
+        tickers = [t for t in tickers if t not in prices]
+        missing = [t for t in dict.fromkeys(tickers) if t not in futures]
+        if missing:
+            # One batched fetch for everything not requested yet
+            task = asyncio.ensure_future(fetch(missing))
+            for ticker in missing:
+                futures[ticker] = task
+        for ticker in tickers:
+            fetched = await futures[ticker]
+            if ticker in fetched:
+                prices[ticker] = fetched[ticker]
+        return prices
+
+    async def stock_prices(self, tickers: Dict[str, str]) -> Dict[str, float]:
+        # {ticker: asset_type} -> {ticker: last close}, as get_stock_prices
+        return await self._prices(
+            self._stock, list(tickers), lambda missing: get_stock_prices({t: tickers[t] for t in missing}),
+            self.published.stock,
+        )
+
+    async def crypto_prices(self, tickers: Iterable[str]) -> Dict[str, float]:
+        return await self._prices(self._crypto, list(tickers), get_crypto_prices_eur, self.published.crypto)
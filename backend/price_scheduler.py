@@ -0,0 +1,74 @@
+import asyncio
+import logging
+import os
+from datetime import date, timedelta
+
+import market_data
+from database import get_pool
+from fx import normalize_currency, quote_currencies
+from price_provider import publish_prices, run_sync
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two refreshes of the published prices
+PRICE_REFRESH_INTERVAL = float(os.getenv("PRICE_REFRESH_INTERVAL", "120"))
+# Pause (seconds) between two provider batches, to stay under the Yahoo Finance / CoinGecko rate limits
+PRICE_REFRESH_BATCH_PAUSE = float(os.getenv("PRICE_REFRESH_BATCH_PAUSE", "1"))
+
+# Tickers held by at least one user, plus those traded in the last month
+# (GET /networth also values the positions of 30 days ago)
+HELD_TICKERS_QUERY = """
+    SELECT DISTINCT asset_type, ticker
+    FROM holdings
+    WHERE net_quantity > 0 OR last_op_date >= $1
+"""
+
+
+async def _fetch_batches(func, batches) -> dict:
+    # Batches are sent one after the other, with a pause in between
+    prices = {}
+    for i, batch in enumerate(batches):
+        if i:
+            await asyncio.sleep(PRICE_REFRESH_BATCH_PAUSE)
+        try:
+            prices.update(await run_sync(func, batch))
+        except Exception as e:
+            logger.warning(f"⚠️ Price refresh failed for {list(batch)}: {e!r}")
+    return prices
+
+
+async def refresh_prices():
+    async with get_pool().acquire() as conn:
+        rows = await conn.fetch(HELD_TICKERS_QUERY, date.today() - timedelta(days=31))
+    stocks = {r["ticker"]: r["asset_type"] for r in rows if r["asset_type"] in ["stock", "etf"]}
+    coins = [r["ticker"] for r in rows if r["asset_type"] == "crypto"]
+
+    # Rates of the currencies the held stocks/ETFs are quoted in (USD always included)
+    currencies = {"USD"} | {normalize_currency(c)[0] for c in (await quote_currencies(stocks)).values()}
+    fx = {}
+    for currency in sorted(currencies - {"EUR"}):
+        rate = await run_sync(market_data.get_fx_rate, currency)
+        if rate is not None:
+            fx[currency] = rate
+
+    stock_prices = await _fetch_batches(
+        market_data.get_stock_prices,
+        [{t: stocks[t] for t in batch} for batch in market_data.chunks(list(stocks))],
+    )
+    crypto_prices = await _fetch_batches(market_data.get_crypto_prices_eur, list(market_data.chunks(coins)))
+
+    snapshot = publish_prices(fx, stock_prices, crypto_prices)
+    logger.info(
+        f"✅ Prices v{snapshot.version} published: {len(stock_prices)}/{len(stocks)} stocks/ETFs, "
+        f"{len(crypto_prices)}/{len(coins)} coins, {len(fx)} FX rates"
+    )
+
+
+async def run_scheduler(interval: float = PRICE_REFRESH_INTERVAL):
+    # Background task started in the app lifespan, the first refresh runs right away
+    while True:
+        try:
+            await refresh_prices()
+        except Exception as e:
+            logger.error(f"❌ Price refresh failed: {e}")
+        await asyncio.sleep(interval)
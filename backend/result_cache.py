@@ -0,0 +1,89 @@
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Set, Tuple
+
+# How long (seconds) a computed result is served from memory at most
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "300"))
+# Memory budget of the cache (approximated by the JSON size of the results)
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+
+
+class ResultCache:
+    """
+    LRU cache of computed endpoint results, keyed by (user_id, ...) tuples.
+
+    The caller puts everything the result depends on in the key (data versions, price
+    snapshot, parameters), so an entry is never stale: invalidate() and the TTL only bound
+    how long unreachable entries take memory.
+    """
+
+    def __init__(self, max_bytes: int = RESULT_CACHE_MAX_BYTES, ttl: float = RESULT_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[Tuple, Tuple[Any, int, float]]" = OrderedDict()  # key -> (value, size, expires_at)
+        self._by_user: Dict[Hashable, Set[Tuple]] = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    async def get_or_compute(self, key: Tuple, compute: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None and entry[2] > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        value = await compute()
+        self._set(key, value)
+        return value
+
+    def _set(self, key: Tuple, value: Any):
+        self._drop(key)
+        size = len(json.dumps(value, default=str))
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (value, size, time.monotonic() + self.ttl)
+        self._by_user.setdefault(key[0], set()).add(key)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _drop(self, key: Tuple):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.bytes -= entry[1]
+        keys = self._by_user.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[key[0]]
+
+    def invalidate(self, user_id: Hashable):
+        # Called on every write of the user
+        keys = self._by_user.pop(user_id, set())
+        for key in keys:
+            self.bytes -= self._entries.pop(key)[1]
+        self.invalidations += len(keys)
+
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+result_cache = ResultCache()
@@ -0,0 +1,251 @@
+import asyncio
+import logging
+import os
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Optional
+
+import asyncpg
+from database import close_pool, get_pool, init_pool
+from fx import fx_service, quote_currencies
+from networth_engine import PRICE_LOOKBACK_DAYS, compute_networth_history
+from price_history import get_price_histories
+from price_provider import fetch_crypto_histories_eur, fetch_stock_histories
+
+logger = logging.getLogger(__name__)
+
+# How often (seconds) today's snapshot is revalued with fresh prices
+SNAPSHOT_TAIL_TTL = float(os.getenv("SNAPSHOT_TAIL_TTL", "3600"))
+# Hour of the day (UTC) of the nightly revaluation of every user
+SNAPSHOT_NIGHTLY_HOUR = int(os.getenv("SNAPSHOT_NIGHTLY_HOUR", "2"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS networth_snapshots (
+    user_id UUID NOT NULL,
+    snapshot_date DATE NOT NULL,
+    cash_balance DOUBLE PRECISION NOT NULL,
+    investment_value DOUBLE PRECISION NOT NULL,
+    net_worth DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (user_id, snapshot_date)
+);
+
+CREATE TABLE IF NOT EXISTS networth_snapshot_state (
+    user_id UUID PRIMARY KEY,
+    dirty_from DATE,
+    last_date DATE,
+    refreshed_at TIMESTAMPTZ,
+    version BIGINT NOT NULL DEFAULT 0
+);
+"""
+
+EARLIEST_DATE_QUERY = """
+    SELECT MIN(t1) AS earliest
+    FROM (
+        SELECT MIN(transaction_date) AS t1 FROM transactions WHERE user_id = $1
+        UNION
+        SELECT MIN(date_of_operation) AS t1 FROM investments WHERE user_id = $1
+    ) as sub
+"""
+
+
+async def ensure_schema(conn: asyncpg.Connection):
+    await conn.execute(SCHEMA)
+
+
+async def mark_dirty(conn: asyncpg.Connection, user_id: str, from_date: date):
+    # Called by every write: snapshots from `from_date` on are recomputed on the next read
+    await conn.execute(
+        """
+        INSERT INTO networth_snapshot_state (user_id, dirty_from, version)
+        VALUES ($1, $2, 1)
+        ON CONFLICT (user_id) DO UPDATE SET
+            dirty_from = LEAST(networth_snapshot_state.dirty_from, EXCLUDED.dirty_from),
+            version = networth_snapshot_state.version + 1
+        """,
+        user_id, from_date,
+    )
+
+
+async def invalidate(conn: asyncpg.Connection, user_id: str):
+    # Drops every snapshot of the user, e.g. after the initial balance changes
+    async with conn.transaction():
+        await conn.execute("DELETE FROM networth_snapshots WHERE user_id = $1", user_id)
+        await conn.execute("DELETE FROM networth_snapshot_state WHERE user_id = $1", user_id)
+
+
+async def _compute(conn: asyncpg.Connection, user_id: str, from_date: Optional[date], today: date):
+    # Recomputes the daily series from `from_date` (or the first record) up to today
+    earliest_date = await conn.fetchval(EARLIEST_DATE_QUERY, user_id)
+    if earliest_date is None:
+        return None, None
+    # Future-dated records (or a write on a future day) still leave today to revalue: before
+    # the first record it is worth zero, as the days the history is padded with
+    from_date = min(max(from_date or earliest_date, earliest_date), today)
+
+    initial_balance = float(await conn.fetchval(
+        "SELECT COALESCE((SELECT initial_balance FROM accounts WHERE user_id = $1 LIMIT 1), 0)", user_id
+    ) or 0)
+    # Daily rollup rows of the range, plus the last one before it (opening balance)
+    rows_cash = await conn.fetch(
+        """
+        SELECT day, balance
+        FROM cashflow_daily
+        WHERE user_id = $1
+          AND day <= $3
+          AND day >= COALESCE((SELECT MAX(day) FROM cashflow_daily WHERE user_id = $1 AND day < $2), $2)
+        ORDER BY day
+        """,
+        user_id, from_date, today,
+    )
+    rows_inv = await conn.fetch(
+        """
+        SELECT date_of_operation, type_of_operation, asset_type, ticker, quantity
+        FROM investments
+        WHERE user_id = $1
+          AND date_of_operation <= $2
+        ORDER BY date_of_operation
+        """,
+        user_id, today,
+    )
+
+    tickers_stock_etf = set()
+    tickers_crypto = set()
+    for r in rows_inv:
+        asset_type = r["asset_type"].lower()
+        if asset_type in ["stock", "etf"]:
+            tickers_stock_etf.add(r["ticker"])
+        elif asset_type == "crypto":
+            tickers_crypto.add(r["ticker"])
+
+    # Quotes slightly before from_date are needed to value its first days
+    price_start = from_date - timedelta(days=PRICE_LOOKBACK_DAYS)
+    yf_histories = await get_price_histories(
+        conn, tickers_stock_etf, "yfinance", price_start, today, fetch_stock_histories
+    )
+    prices_yf = {tck: yf_histories.get(tck.upper(), {}) for tck in tickers_stock_etf}
+    # Stocks/ETFs are converted from their own quote currency, each quote at its day's rate
+    prices_yf = await fx_service.to_eur(prices_yf, await quote_currencies(prices_yf), price_start)
+
+    cg_histories = await get_price_histories(
+        conn, tickers_crypto, "coingecko", price_start, today, fetch_crypto_histories_eur
+    )
+    # Stock/ETF quotes take precedence over a coin with the same ticker
+    prices = {tck: cg_histories[tck.upper()] for tck in tickers_crypto if cg_histories.get(tck.upper())}
+    prices.update(prices_yf)
+
+    history = compute_networth_history(
+        from_date, today, earliest_date, initial_balance, rows_cash, rows_inv, prices,
+    )
+    return earliest_date, history
+
+
+async def refresh(conn: asyncpg.Connection, user_id: str, from_date: Optional[date] = None, version: Optional[int] = None):
+    """
+    Rewrites the snapshots of the user from `from_date` (None: from the first record) to today.
+    The dirty marker is cleared only if no write happened meanwhile (same `version`).
+    """
+    today = date.today()
+    earliest_date, history = await _compute(conn, user_id, from_date, today)
+
+    async with conn.transaction():
+        # Concurrent refreshes of the same user (reads, nightly job) would insert the same days:
+        # their writes take turns, and each one deletes what the previous one wrote
+        await conn.execute("SELECT pg_advisory_xact_lock(hashtext('snapshots'), hashtext($1))", str(user_id))
+        if earliest_date is None:
+            await conn.execute("DELETE FROM networth_snapshots WHERE user_id = $1", user_id)
+        else:
+            start = history.index[0].date()
+            await conn.execute(
+                "DELETE FROM networth_snapshots WHERE user_id = $1 AND (snapshot_date < $2 OR snapshot_date >= $3)",
+                user_id, min(earliest_date, start), start,
+            )
+            await conn.copy_records_to_table(
+                "networth_snapshots",
+                columns=["user_id", "snapshot_date", "cash_balance", "investment_value", "net_worth"],
+                records=zip(
+                    [user_id] * len(history),
+                    history.index.date,
+                    history["cash"].tolist(),
+                    history["investments"].tolist(),
+                    history["networth"].tolist(),
+                ),
+            )
+        await conn.execute(
+            """
+            INSERT INTO networth_snapshot_state (user_id, dirty_from, last_date, refreshed_at)
+            VALUES ($1, NULL, $2, now())
+            ON CONFLICT (user_id) DO UPDATE SET
+                dirty_from = CASE WHEN networth_snapshot_state.version = $3 THEN NULL
+                                  ELSE networth_snapshot_state.dirty_from END,
+                last_date = EXCLUDED.last_date,
+                refreshed_at = EXCLUDED.refreshed_at
+            """,
+            user_id, today, version if version is not None else 0,
+        )
+
+
+async def ensure_fresh(conn: asyncpg.Connection, user_id: str):
+    # Recomputes only what is missing: dirty days, days since the last run, a stale today
+    state = await conn.fetchrow(
+        "SELECT dirty_from, last_date, refreshed_at, version FROM networth_snapshot_state WHERE user_id = $1",
+        user_id,
+    )
+    if state is None or state["last_date"] is None:
+        await refresh(conn, user_id, None, state["version"] if state else None)
+        return
+
+    from_date = state["dirty_from"]
+    age = (datetime.now(timezone.utc) - state["refreshed_at"]).total_seconds()
+    if state["last_date"] < date.today() or age > SNAPSHOT_TAIL_TTL:
+        from_date = min(from_date or state["last_date"], state["last_date"])
+    if from_date is not None:
+        await refresh(conn, user_id, from_date, state["version"])
+
+
+async def get_snapshots(conn: asyncpg.Connection, user_id: str, end_date: date) -> List[asyncpg.Record]:
+    return await conn.fetch(
+        """
+        SELECT snapshot_date, net_worth, investment_value, cash_balance
+        FROM networth_snapshots
+        WHERE user_id = $1 AND snapshot_date <= $2
+        ORDER BY snapshot_date
+        """,
+        user_id, end_date,
+    )
+
+
+async def refresh_all_users():
+    # Nightly job: appends the new day (and revalues the last one) for every known user
+    async with get_pool().acquire() as conn:
+        user_ids = [r["user_id"] for r in await conn.fetch("SELECT user_id FROM networth_snapshot_state")]
+    for user_id in user_ids:
+        try:
+            async with get_pool().acquire() as conn:
+                await ensure_fresh(conn, str(user_id))
+        except Exception as e:
+            logger.error(f"❌ Snapshot refresh failed for {user_id}: {e}")
+    logger.info(f"✅ Net worth snapshots refreshed for {len(user_ids)} users")
+
+
+async def run_nightly(hour: int = SNAPSHOT_NIGHTLY_HOUR):
+    # Background task started in the app lifespan
+    while True:
+        now = datetime.now(timezone.utc)
+        next_run = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+        if next_run <= now:
+            next_run += timedelta(days=1)
+        await asyncio.sleep((next_run - now).total_seconds())
+        await refresh_all_users()
+
+
+if __name__ == "__main__":
+    # Can also be run from cron: python snapshots.py
+    async def _main():
+        pool = await init_pool()
+        async with pool.acquire() as conn:
+            await ensure_schema(conn)
+        try:
+            await refresh_all_users()
+        finally:
+            await close_pool()
+
+    asyncio.run(_main())
@@ -0,0 +1,87 @@
+import hashlib
+from typing import Iterable
+
+import asyncpg
+from auth import verify_token
+from database import get_db
+from fastapi import Depends, HTTPException, Request, Response
+from result_cache import result_cache
+
+# Data that a client can cache, each with its own per-user version counter
+SCOPES = ("transactions", "investments", "categories", "account")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS data_versions (
+    user_id UUID NOT NULL,
+    scope TEXT NOT NULL,
+    version BIGINT NOT NULL,
+    PRIMARY KEY (user_id, scope)
+);
+"""
+
+
+async def ensure_schema(conn: asyncpg.Connection):
+    await conn.execute(SCHEMA)
+
+
+async def bump(conn, user_id: str, scopes: Iterable[str]):
+    # Called by every write, in its DB transaction when it has one
+    scopes = sorted(set(scopes))
+    if not scopes:
+        return
+    # The user's cached results are keyed by the old versions: free them right away
+    result_cache.invalidate(user_id)
+    await conn.execute(
+        """
+        INSERT INTO data_versions (user_id, scope, version)
+        SELECT $1, scope, 1 FROM unnest($2::text[]) AS scope
+        ON CONFLICT (user_id, scope) DO UPDATE SET version = data_versions.version + 1
+        """,
+        user_id, scopes,
+    )
+
+
+async def get_versions(conn, user_id: str, scopes: Iterable[str]) -> str:
+    # "transactions:3,categories:1", scopes never written count as version 0
+    scopes = list(scopes)
+    rows = await conn.fetch(
+        "SELECT scope, version FROM data_versions WHERE user_id = $1 AND scope = ANY($2::text[])",
+        user_id, scopes,
+    )
+    versions = {r["scope"]: r["version"] for r in rows}
+    return ",".join(f"{scope}:{versions.get(scope, 0)}" for scope in scopes)
+
+
+def _etag(user_id: str, versions: str, request: Request) -> str:
+    # Strong ETag of one representation: same user, same data versions, same URL
+    digest = hashlib.sha256(f"{user_id}|{versions}|{request.url.path}?{request.url.query}".encode())
+    return f'"{digest.hexdigest()[:32]}"'
+
+
+class ConditionalGet:
+    """
+    Dependency for list endpoints: sets the ETag of the response from the user's data
+    versions of `scopes`, and answers 304 Not Modified (before the endpoint runs its query)
+    when the client's If-None-Match already holds it.
+    """
+
+    def __init__(self, *scopes: str):
+        self.scopes = scopes
+
+    async def __call__(
+        self,
+        request: Request,
+        response: Response,
+        user_id: str = Depends(verify_token),
+        db: asyncpg.Connection = Depends(get_db),
+    ):
+        etag = _etag(user_id, await get_versions(db, user_id, self.scopes), request)
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match:
+            # Weak comparison, as RFC 9110 requires for If-None-Match
+            candidates = {tag.strip() for tag in if_none_match.split(",")}
+            candidates |= {tag[2:] for tag in candidates if tag.startswith("W/")}
+            if etag in candidates or "*" in candidates:
+                raise HTTPException(status_code=304, headers=headers)
+        response.headers.update(headers)